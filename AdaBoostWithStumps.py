@@ -1,7 +1,12 @@
 import math
 import random
 import pickle
+import sys
+from array import array
 from loadData import *
+from featureMatrix import FeatureMatrix, SparseFeatureMatrix, as_feature_matrix
+from featureStore import FeatureStore
+from instrumentation import phase
 class DecisionStump:
     def __init__(self):
         self.polarity = 1
@@ -10,85 +15,568 @@ class DecisionStump:
         self.alpha = None
 
     def predict(self, X):
-        predictions = []
         # Make predictions based on the threshold and polarity
-        for sample in X:
-            val = sample[self.feature_index]
-            prediction = 1 if self.polarity * val < self.polarity * self.threshold else -1
-            predictions.append(prediction)
-        return predictions
+        column = as_feature_matrix(X).column(self.feature_index)
+        polarity = self.polarity
+        threshold = polarity * self.threshold
+        return [1 if polarity * val < threshold else -1 for val in column]
+
+class SortedFeatures:
+    """
+    Feature columns sorted once before boosting starts.
+
+    For every feature this keeps the row order by value, the unique values (the candidate
+    thresholds) with the end position of each value's run, and the order in which the
+    exhaustive search used to visit those thresholds, which decides between equal errors.
+    """
+    def __init__(self, X):
+        X = as_feature_matrix(X)
+        self.n_samples = len(X)
+        self.features = []
+        for column in X.columns:
+            order = sorted(range(self.n_samples), key=column.__getitem__)
+            thresholds, group_ends = [], []
+            for pos, i in enumerate(order):
+                if thresholds and thresholds[-1] == column[i]:
+                    group_ends[-1] = pos + 1
+                else:
+                    thresholds.append(column[i])
+                    group_ends.append(pos + 1)
+            visit_rank = {value: rank for rank, value in enumerate(set(column))}
+            self.features.append((order, thresholds, group_ends, visit_rank))
+
+    @property
+    def n_candidates(self):
+        # Thresholds scored per class in every boosting round
+        return sum(len(thresholds) for _, thresholds, _, _ in self.features)
+
+class SparseSortedFeatures:
+    """
+    SortedFeatures for a SparseFeatureMatrix, built from the non-zero entries only.
+
+    Each feature keeps its non-zero rows sorted by value and its candidate thresholds, with
+    0 inserted at zero_group when some rows have no entry: those rows form one implicit
+    block whose weight is the total minus the weight of the entries. Features without any
+    entry all give the same stump, so only the first of them is kept.
+    """
+    def __init__(self, X):
+        self.n_samples = len(X)
+        self.features = []
+        nonzero = X.nonzero_features()
+        first_empty = next((f for f, g in enumerate(nonzero) if f != g), len(nonzero))
+        if first_empty < X.n_features:
+            self.features.append((first_empty, [], [0.0], [0], 0))
+        for feature_index in nonzero:
+            rows, values = X.column_entries(feature_index)
+            entries = sorted(zip(values, rows))
+            order = [i for _, i in entries]
+            thresholds, group_ends = [], []
+            zero_group = None
+            for pos, (value, _) in enumerate(entries):
+                if zero_group is None and value > 0 and len(entries) < self.n_samples:
+                    zero_group = len(thresholds)
+                    thresholds.append(0.0)
+                    group_ends.append(pos)
+                if thresholds and thresholds[-1] == value:
+                    group_ends[-1] = pos + 1
+                else:
+                    thresholds.append(value)
+                    group_ends.append(pos + 1)
+            if zero_group is None and len(entries) < self.n_samples:
+                zero_group = len(thresholds)
+                thresholds.append(0.0)
+                group_ends.append(len(entries))
+            self.features.append((feature_index, order, thresholds, group_ends, zero_group))
+        self.features.sort(key=lambda feature: feature[0])
+
+    @property
+    def n_candidates(self):
+        return sum(len(thresholds) for _, _, thresholds, _, _ in self.features)
+
+def find_best_stump(sorted_features, y, w):
+    """
+    Finds the stump with the lowest weighted error in one sweep per presorted feature.
+
+    A stump predicts 1 below its threshold, so the error of threshold t is the weight of
+    negative samples below t plus the weight of positive samples at or above it. Both are
+    running sums over the sorted rows, which makes each round O(features * n).
+
+    :param sorted_features: SortedFeatures built from the training features.
+    :param y: Labels, 1 or -1.
+    :param w: Current sample weights.
+    :return: Tuple (feature_index, threshold, polarity, error).
+    """
+    return find_best_stumps(sorted_features, [y], [w])[0]
+
+def find_best_stumps(sorted_features, ys, ws):
+    """
+    Runs find_best_stump for several label vectors in one shared sweep.
+
+    The sorted rows and candidate thresholds are walked once and the running sums of every
+    label vector are advanced together, so one-vs-all training over many classes visits the
+    data once per feature instead of once per class. Each result is the same as calling
+    find_best_stump on that label vector alone.
+
+    :param sorted_features: SortedFeatures built from the training features.
+    :param ys: One label vector (1 or -1) per class.
+    :param ws: Current sample weights, one vector per class.
+    :return: List of (feature_index, threshold, polarity, error), one per class.
+    """
+    if isinstance(sorted_features, SparseSortedFeatures):
+        return _find_best_sparse_stumps(sorted_features, ys, ws)
+    classes = range(len(ys))
+    pos_ws = [[w_i if y_i == 1 else 0.0 for w_i, y_i in zip(w, y)] for y, w in zip(ys, ws)]
+    neg_ws = [[0.0 if y_i == 1 else w_i for w_i, y_i in zip(w, y)] for y, w in zip(ys, ws)]
+    pos_totals = [sum(pos_w) for pos_w in pos_ws]
+
+    # Running sums round differently from the exhaustive search's per-row sums. Errors within
+    # this tolerance of the best are recomputed its way and compared like it did: the lower
+    # error wins, then the first feature, then the threshold it visited first
+    tolerance = 4 * sorted_features.n_samples * sys.float_info.epsilon
+
+    # Per class: feature, threshold, polarity, error, visit rank and sorted start position of
+    # the threshold, and (error, polarity) as the exhaustive search computed them, once known
+    best = [(None, None, 1, float('inf'), None, None, None) for _ in classes]
+    for feature_i, (order, thresholds, group_ends, visit_rank) in enumerate(sorted_features.features):
+        pos_below = [0.0 for _ in classes]
+        neg_below = [0.0 for _ in classes]
+        start = 0
+        for threshold, end in zip(thresholds, group_ends):
+            rank = visit_rank[threshold]
+            for k in classes:
+                p = 1
+                error = neg_below[k] + (pos_totals[k] - pos_below[k])
+
+                # Update polarity if error is more than 50%
+                if error > 0.5:
+                    error = 1 - error
+                    p = -1
+
+                best_feature, _, _, min_error, best_rank, best_start, best_exact = best[k]
+                if error < min_error - tolerance:
+                    best[k] = (feature_i, threshold, p, error, rank, start, None)
+                elif error <= min_error + tolerance:
+                    if best_exact is None:
+                        best_exact = _exhaustive_error(sorted_features.features[best_feature][0], best_start, ys[k], ws[k])
+                        best[k] = best[k][:6] + (best_exact,)
+                    exact = _exhaustive_error(order, start, ys[k], ws[k])
+                    if exact[0] < best_exact[0] or (exact[0] == best_exact[0] and feature_i == best_feature and rank < best_rank):
+                        best[k] = (feature_i, threshold, p, error, rank, start, exact)
+
+            # Move this value's rows below the next threshold
+            for pos in range(start, end):
+                i = order[pos]
+                for k in classes:
+                    pos_below[k] += pos_ws[k][i]
+                    neg_below[k] += neg_ws[k][i]
+            start = end
+
+    # Error and polarity of every pick as the exhaustive search computed them
+    stumps = []
+    for k, (feature_i, threshold, p, error, _, start, exact) in enumerate(best):
+        if feature_i is not None:
+            error, p = exact or _exhaustive_error(sorted_features.features[feature_i][0], start, ys[k], ws[k])
+        stumps.append((feature_i, threshold, p, error))
+    return stumps
+
+def _exhaustive_error(order, start, y, w):
+    # (error, polarity) of the threshold with the rows order[:start] below it, summed like the
+    # exhaustive search: the weights of the misclassified rows in row order, flipped above 0.5
+    below = bytearray(len(y))
+    for i in order[:start]:
+        below[i] = 1
+    error = sum([w_i for w_i, y_i, is_below in zip(w, y, below) if (y_i == 1) != is_below])
+    if error > 0.5:
+        return 1 - error, -1
+    return error, 1
+
+def _find_best_sparse_stumps(sorted_features, ys, ws):
+    # find_best_stumps over SparseSortedFeatures: the sweep walks the non-zero rows and adds
+    # the implicit zero block in one step. Equal errors keep the first feature and threshold.
+    classes = range(len(ys))
+    pos_ws = [[w_i if y_i == 1 else 0.0 for w_i, y_i in zip(w, y)] for y, w in zip(ys, ws)]
+    neg_ws = [[0.0 if y_i == 1 else w_i for w_i, y_i in zip(w, y)] for y, w in zip(ys, ws)]
+    pos_totals = [sum(pos_w) for pos_w in pos_ws]
+    neg_totals = [sum(neg_w) for neg_w in neg_ws]
+
+    best = [(None, None, 1, float('inf')) for _ in classes]
+    for feature_index, order, thresholds, group_ends, zero_group in sorted_features.features:
+        if zero_group is not None:
+            # Weight of the rows without an entry for this feature
+            pos_zero = [pos_totals[k] - sum([pos_ws[k][i] for i in order]) for k in classes]
+            neg_zero = [neg_totals[k] - sum([neg_ws[k][i] for i in order]) for k in classes]
+        pos_below = [0.0 for _ in classes]
+        neg_below = [0.0 for _ in classes]
+        start = 0
+        for group, (threshold, end) in enumerate(zip(thresholds, group_ends)):
+            for k in classes:
+                p = 1
+                error = neg_below[k] + (pos_totals[k] - pos_below[k])
+
+                # Update polarity if error is more than 50%
+                if error > 0.5:
+                    error = 1 - error
+                    p = -1
+
+                if error < best[k][3]:
+                    best[k] = (feature_index, threshold, p, error)
+
+            # Move this value's rows below the next threshold
+            if group == zero_group:
+                for k in classes:
+                    pos_below[k] += pos_zero[k]
+                    neg_below[k] += neg_zero[k]
+                continue
+            for pos in range(start, end):
+                i = order[pos]
+                for k in classes:
+                    pos_below[k] += pos_ws[k][i]
+                    neg_below[k] += neg_ws[k][i]
+            start = end
+
+    return best
 
 class AdaBoost:
     def __init__(self, n_learners=5):
         self.n_learners = n_learners  # Number of weak learners (stumps) to use
         self.learners = []
 
-    def fit(self, X, y):
+    def fit(self, X, y, warm_start=False):
+        """
+        Trains stumps until the model holds n_learners of them.
+
+        :param X: Training features.
+        :param y: Training labels, 1 or -1.
+        :param warm_start: Keep the existing learners and only train the missing rounds, e.g. to
+                           resume a pickled model after raising n_learners. X and y must be the data
+                           the existing learners were trained on.
+        """
+        for _ in self.staged_fit(X, y, warm_start=warm_start):
+            pass
+
+    def staged_fit(self, X, y, warm_start=False):
+        # Same as fit, but yields the model after every boosting round
+        X = as_feature_matrix(X)
         n_samples = len(X)
         w = [1 / n_samples for _ in range(n_samples)]  # Initialize weights
+        if warm_start:
+            # Replay the weight updates of the learners we already have
+            for learner in self.learners:
+                w = _update_weights(w, y, learner.alpha, learner.predict(X))
+        else:
+            self.learners = []
+        with phase('presort', rows=n_samples):
+            sorted_features = _sorted_features(X)  # Sorted once, reused by every round
+        n_candidates = sorted_features.n_candidates
+
+        while len(self.learners) < self.n_learners:
+            with phase('boosting_round', round=len(self.learners), rows=n_samples):
+                learner = DecisionStump()
+                with phase('split_search', rows=n_samples) as timing:
+                    learner.feature_index, learner.threshold, learner.polarity, min_error = find_best_stump(sorted_features, y, w)
+                    timing.add(candidates=n_candidates)
+                learner.alpha = _learner_alpha(min_error)
+                with phase('weight_update', rows=n_samples):
+                    w = _update_weights(w, y, learner.alpha, learner.predict(X))
 
-        for _ in range(self.n_learners):
-            learner = DecisionStump()
-            min_error = float('inf')
+            self.learners.append(learner)
+            yield self
 
-            # Iterate over each feature and find the best threshold
-            for feature_i in range(len(X[0])):
-                feature_values = [sample[feature_i] for sample in X]
-                unique_values = set(feature_values)
+    def staged_decision_function(self, X):
+        # Yields the aggregated scores after each learner, updated in place of a full re-score
+        return self.pack().staged_decision_function(X)
 
-                # Test all possible thresholds
-                for threshold in unique_values:
-                    p = 1
-                    predictions = [1 if feature_values[i] < threshold else -1 for i in range(n_samples)]
+    def staged_predict(self, X):
+        # Yields the predictions of the first 1, 2, ... learners
+        for final_output in self.staged_decision_function(X):
+            yield [1 if prediction > 0 else -1 for prediction in final_output]
 
+    def prefix(self, n_learners):
+        # Model made of the first n_learners stumps, which is what training with n_learners gives
+        model = AdaBoost(n_learners=n_learners)
+        model.learners = self.learners[:n_learners]
+        return model
 
-                    # Calculate weighted error
-                    missclassified = [w[i] for i in range(n_samples) if y[i] != predictions[i]]
-                    error = sum(missclassified)
+    def pack(self):
+        return PackedStumps.from_learners(self.learners)
 
-                    # Update polarity if error is more than 50%
-                    if error > 0.5:
-                        error = 1 - error
-                        p = -1
+    def decision_function(self, X):
+        # Raw ensemble score (margin) of each sample; its sign is the prediction
+        return self.pack().decision_function(X)
 
-                    # Store the best stump
-                    if error < min_error:
-                        learner.polarity = p
-                        learner.threshold = threshold
-                        learner.feature_index = feature_i
-                        min_error = error
+    def predict(self, X, early_exit=True):
+        return self.pack().predict(X, early_exit)
 
-            # Calculate alpha (learner weight)
-            EPS = 1e-10
-            min_error = max(EPS, min(min_error, 1 - EPS))
+class PackedStumps:
+    """
+    Trained AdaBoost ensemble packed into parallel arrays for batch scoring.
 
-            # Ensure the value inside the square root is non-negative
-            value = (1.0 - min_error) / (min_error + EPS)
-            learner.alpha = 0.5 * math.log(value) if value > 0 else 0
+    Learner k predicts 1 when polarity[k] * x[feature_index[k]] < polarity[k] * threshold[k]
+    and -1 otherwise, weighted by alpha[k]. Scores are accumulated in learner order, so the
+    margins are exactly the ones AdaBoost.predict used to compute.
+    """
+    def __init__(self, feature_index, threshold, polarity, alpha):
+        self.feature_index = feature_index
+        self.threshold = threshold
+        self.polarity = polarity
+        self.alpha = alpha
+        self._cascade = None
+
+    @classmethod
+    def from_learners(cls, learners):
+        return cls(array('l', [learner.feature_index for learner in learners]),
+                   array('d', [learner.threshold for learner in learners]),
+                   array('b', [learner.polarity for learner in learners]),
+                   array('d', [learner.alpha for learner in learners]))
+
+    def __len__(self):
+        return len(self.alpha)
+
+    def staged_decision_function(self, X):
+        # Yields the margins after each learner; every learner is one pass over a single column
+        X = as_feature_matrix(X)
+        margins = [0 for _ in range(len(X))]
+        for feature_index, threshold, polarity, alpha in zip(self.feature_index, self.threshold, self.polarity, self.alpha):
+            column = X.column(feature_index)
+            if polarity == 1:
+                margins = [margin + alpha if val < threshold else margin - alpha for margin, val in zip(margins, column)]
+            else:
+                # -val < -threshold is val > threshold, and NaN still scores -1
+                margins = [margin + alpha if val > threshold else margin - alpha for margin, val in zip(margins, column)]
+            yield margins
+
+    def decision_function(self, X):
+        margins = [0 for _ in range(len(X))]
+        for margins in self.staged_decision_function(X):
+            pass
+        return margins
+
+    def predict(self, X, early_exit=True):
+        # Final prediction: sign of the aggregated predictions. With early_exit, rows stop
+        # being scored once their sign is settled (StumpCascade); the result is the same.
+        if early_exit:
+            return self.cascade().predict(X)
+        return [1 if margin > 0 else -1 for margin in self.decision_function(X)]
+
+    def cascade(self):
+        # StumpCascade of this ensemble, built once
+        if self._cascade is None:
+            self._cascade = StumpCascade(self)
+        return self._cascade
+
+def _cascade_check(step, n_steps):
+    # Steps after which rows are checked for an early exit: 4, 8, 16, ... and the last one,
+    # as a check costs more than one learner
+    return step == n_steps or step >= 4 and step & (step - 1) == 0
+
+class StumpCascade:
+    """
+    Early-exit scoring of a PackedStumps ensemble with exactly the same results.
 
-            predictions = learner.predict(X)
+    Boosting often picks the same stump in several rounds; such repeats always vote alike, so
+    they are evaluated once with their alphas added up. The merged learners are visited in
+    order of decreasing |alpha|. After k of them, the final margin of a row is within
+    bounds[k] of its running margin: the |alpha| mass still to come plus a slack covering
+    floating-point rounding, including the different summation order. A row whose running
+    margin is further from 0 than that is decided; rows never decided are scored in full,
+    in the original learner order.
 
-            # Update weights
-            w = [w[i] * ((-learner.alpha * y[i] * predictions[i]) + 1) for i in range(n_samples)]
-            w_sum = sum(w)
-            w = [w_i / w_sum for w_i in w]  # Normalize weights
+    :param stumps: PackedStumps to score.
+    """
+    def __init__(self, stumps):
+        self.stumps = stumps
+        merged = {}
+        for learner in zip(stumps.feature_index, stumps.threshold, stumps.polarity, stumps.alpha):
+            key = learner[:3]
+            merged[key] = merged.get(key, 0.0) + learner[3]
+        self.learners = sorted([key + (alpha,) for key, alpha in merged.items()], key=lambda learner: -abs(learner[3]))
+        mass = [0.0] * (len(self.learners) + 1)
+        for k in reversed(range(len(self.learners))):
+            mass[k] = mass[k + 1] + abs(self.learners[k][3])
+        total = sum(abs(alpha) for alpha in stumps.alpha)
+        slack = 8 * (len(stumps) + 1) * sys.float_info.epsilon * total
+        self.bounds = [remaining + slack for remaining in mass]
+
+    def __len__(self):
+        return len(self.learners)
+
+    def apply(self, k, X, margins, rows):
+        # Add learner k's vote to the running margins of the given rows
+        feature_index, threshold, polarity, alpha = self.learners[k]
+        column = X.column(feature_index)
+        if polarity == 1:
+            for i in rows:
+                margins[i] += alpha if column[i] < threshold else -alpha
+        else:
+            for i in rows:
+                margins[i] += alpha if column[i] > threshold else -alpha
 
-            self.learners.append(learner)
+    def predict(self, X):
+        # Same as PackedStumps.predict
+        X = as_feature_matrix(X)
+        predictions = [None] * len(X)
+        margins = [0.0] * len(X)
+        rows = list(range(len(X)))
+        for k in range(len(self.learners)):
+            self.apply(k, X, margins, rows)
+            if not _cascade_check(k + 1, len(self.learners)):
+                continue
+            bound = self.bounds[k + 1]
+            undecided = []
+            for i in rows:
+                margin = margins[i]
+                if margin > bound:
+                    predictions[i] = 1
+                elif margin < -bound:
+                    predictions[i] = -1
+                else:
+                    undecided.append(i)
+            rows = undecided
+            if not rows:
+                return predictions
+        for i, margin in zip(rows, self.stumps.decision_function(X.take(rows))):
+            predictions[i] = 1 if margin > 0 else -1
+        return predictions
+
+# One-vs-all ensembles with fewer (merged) learners per class are scored in full
+CASCADE_MIN_LEARNERS = 20
+
+def predict_multiclass_cascade(models, X, classes):
+    """
+    One-vs-all prediction with early exits, exactly equal to taking the class of the highest margin.
+
+    All class models advance together, strongest learners first. At every check a class is
+    dropped for a row once its highest possible margin is below the lowest possible margin of
+    another class, and the row is decided when one class is left; the remaining learners of
+    that row are skipped for every class. Rows still open at the end are scored in full.
+
+    :param models: AdaBoost or PackedStumps models, one per class.
+    :param X: FeatureMatrix or list of feature rows.
+    :param classes: Class of each model.
+    :return: Predicted class of every row; ties go to the first class, as in predict_multiclass.
+    """
+    X = as_feature_matrix(X)
+    cascades = [(model.pack() if isinstance(model, AdaBoost) else model).cascade() for model in models]
+    n_classes = len(cascades)
+    predictions = [None] * len(X)
+    margins = [[0.0] * len(X) for _ in cascades]
+    candidates = [list(range(n_classes)) for _ in range(len(X))]
+    rows = list(range(len(X)))
+    active = [rows for _ in cascades]
+    n_steps = max([len(cascade) for cascade in cascades], default=0)
+    if n_steps < CASCADE_MIN_LEARNERS:
+        n_steps = 0  # Too few learners for the checks to pay off: score every row in full
+    for k in range(n_steps):
+        for cascade, class_margins, class_rows in zip(cascades, margins, active):
+            if k < len(cascade):
+                cascade.apply(k, X, class_margins, class_rows)
+        if not _cascade_check(k + 1, n_steps):
+            continue
+        bounds = [cascade.bounds[min(k + 1, len(cascade))] for cascade in cascades]
+        undecided = []
+        for i in rows:
+            row_classes = candidates[i]
+            lead = max([margins[c][i] - bounds[c] for c in row_classes])
+            row_classes = [c for c in row_classes if margins[c][i] + bounds[c] >= lead]
+            if len(row_classes) == 1:
+                predictions[i] = classes[row_classes[0]]
+            else:
+                candidates[i] = row_classes
+                undecided.append(i)
+        rows = undecided
+        if not rows:
+            return predictions
+        active = [[i for i in rows if c in candidates[i]] for c in range(n_classes)]
+
+    if rows:
+        X_open = X.take(rows)
+        for i, scores in zip(rows, zip(*[cascade.stumps.decision_function(X_open) for cascade in cascades])):
+            scores = list(scores)
+            predictions[i] = classes[scores.index(max(scores))]
+    return predictions
+
+class OneVsAllAdaBoost:
+    """
+    One AdaBoost model per class, trained together.
+
+    The feature columns are sorted once and every boosting round finds the stumps of all
+    classes in a single shared sweep (find_best_stumps). Each per-class model ends up
+    identical to an AdaBoost trained on that class against the rest.
+    """
+    def __init__(self, classes, n_learners=5):
+        self.classes = list(classes)
+        self.n_learners = n_learners
+        self.models = [AdaBoost(n_learners=n_learners) for _ in self.classes]
+
+    def fit(self, X, labels):
+        for _ in self.staged_fit(X, labels):
+            pass
+
+    def staged_fit(self, X, labels):
+        # Yields the ensemble after every boosting round
+        X = as_feature_matrix(X)
+        n_samples = len(X)
+        ys = [[1 if label == cls else -1 for label in labels] for cls in self.classes]
+        ws = [[1 / n_samples for _ in range(n_samples)] for _ in self.classes]
+        with phase('presort', rows=n_samples):
+            sorted_features = _sorted_features(X)  # Shared by every class and every round
+        n_candidates = sorted_features.n_candidates * len(self.classes)
+        for model in self.models:
+            model.n_learners = self.n_learners
+            model.learners = []
+
+        for round_index in range(self.n_learners):
+            with phase('boosting_round', round=round_index, rows=n_samples, classes=len(self.classes)):
+                with phase('split_search', rows=n_samples) as timing:
+                    stumps = find_best_stumps(sorted_features, ys, ws)
+                    timing.add(candidates=n_candidates)
+                with phase('weight_update', rows=n_samples):
+                    for k, (model, (feature_index, threshold, polarity, min_error)) in enumerate(zip(self.models, stumps)):
+                        learner = DecisionStump()
+                        learner.feature_index, learner.threshold, learner.polarity = feature_index, threshold, polarity
+                        learner.alpha = _learner_alpha(min_error)
+                        ws[k] = _update_weights(ws[k], ys[k], learner.alpha, learner.predict(X))
+                        model.learners.append(learner)
+            yield self
+
+    def decision_function(self, X):
+        # All class scores at once: one list of per-class scores for each sample
+        X = as_feature_matrix(X)
+        class_scores = [model.decision_function(X) for model in self.models]
+        return [list(scores) for scores in zip(*class_scores)]
 
     def predict(self, X):
-        final_output = [0 for _ in range(len(X))]
-        # Aggregate predictions from all learners
-        for learner in self.learners:
-            learner_predictions = learner.predict(X)
-            final_output = [final_output[i] + learner.alpha * learner_predictions[i] for i in range(len(X))]
+        # Class with the highest score for each sample
+        return [self.classes[scores.index(max(scores))] for scores in self.decision_function(X)]
 
-        # Final prediction: sign of the aggregated predictions
-        return [1 if prediction > 0 else -1 for prediction in final_output]
+def _sorted_features(X):
+    if isinstance(X, SparseFeatureMatrix):
+        return SparseSortedFeatures(X)
+    return SortedFeatures(X)
+
+def _learner_alpha(min_error):
+    # Calculate alpha (learner weight)
+    EPS = 1e-10
+    min_error = max(EPS, min(min_error, 1 - EPS))
+
+    # Ensure the value inside the square root is non-negative
+    value = (1.0 - min_error) / (min_error + EPS)
+    return 0.5 * math.log(value) if value > 0 else 0
+
+def _update_weights(w, y, alpha, predictions):
+    # Reweight samples after a boosting round and normalize
+    w = [w[i] * ((-alpha * y[i] * predictions[i]) + 1) for i in range(len(w))]
+    w_sum = sum(w)
+    return [w_i / w_sum for w_i in w]
 
 def tune_number_of_learners(X_train, y_train, X_val, y_val, learner_values):
     """
     Tunes the number of learners in the AdaBoost classifier.
 
+    Boosting is staged, so a model with fewer learners is a prefix of one with more. A single
+    model is trained up to the largest value and each prefix is scored from the running
+    validation scores.
+
     :param X_train: Training features.
     :param y_train: Training labels.
     :param X_val: Validation features.
@@ -96,20 +584,56 @@ def tune_number_of_learners(X_train, y_train, X_val, y_val, learner_values):
     :param learner_values: List of number of learner values to try.
     :return: Best number of learners and the corresponding AdaBoost model.
     """
+    model = AdaBoost(n_learners=max(learner_values))
+    model.fit(X_train, y_train)
+    return _best_prefix(model, X_val, y_val, learner_values)
+
+def tune_number_of_learners_multiclass(X_train, labels_train, X_val, labels_val, classes, learner_values):
+    """
+    Tunes the number of learners of one-vs-all AdaBoost models for several classes at once.
+
+    All classes are trained in one OneVsAllAdaBoost run and share the presorted features,
+    then each class picks its best prefix as tune_number_of_learners does.
+
+    :param X_train: Training features.
+    :param labels_train: Training class labels.
+    :param X_val: Validation features.
+    :param labels_val: Validation class labels.
+    :param classes: Classes to train a one-vs-all model for.
+    :param learner_values: List of number of learner values to try.
+    :return: List of (best number of learners, best accuracy, AdaBoost model), one per class.
+    """
+    ensemble = OneVsAllAdaBoost(classes, n_learners=max(learner_values))
+    ensemble.fit(X_train, labels_train)
+    results = []
+    for cls, model in zip(ensemble.classes, ensemble.models):
+        y_val = [1 if label == cls else -1 for label in labels_val]
+        results.append(_best_prefix(model, X_val, y_val, learner_values))
+    return results
+
+def _best_prefix(model, X_val, y_val, learner_values):
+    # Pick the best number of learners from the running validation scores of a trained model
     best_n_learners = None
     best_accuracy = float('-inf')
     best_model = None
 
-    for n_learners in learner_values:
-        model = AdaBoost(n_learners=n_learners)
-        model.fit(X_train, y_train)
-        predictions = model.predict(X_val)
-        accuracy = sum(1 for i in range(len(y_val)) if y_val[i] == predictions[i]) / len(y_val)
+    accuracies = {}
+    with phase('validation', rows=len(y_val)):
+        staged_scores = model.staged_decision_function(X_val)
+        final_output = [0 for _ in range(len(y_val))]
+        for n_learners in range(model.n_learners + 1):
+            if n_learners > 0:
+                final_output = next(staged_scores)
+            if n_learners in learner_values:
+                predictions = [1 if prediction > 0 else -1 for prediction in final_output]
+                accuracies[n_learners] = sum(1 for i in range(len(y_val)) if y_val[i] == predictions[i]) / len(y_val)
 
+    for n_learners in learner_values:
+        accuracy = accuracies[n_learners]
         if accuracy > best_accuracy:
             best_n_learners = n_learners
             best_accuracy = accuracy
-            best_model = model
+            best_model = model.prefix(n_learners)
 
     return best_n_learners, best_accuracy, best_model
 
@@ -119,39 +643,60 @@ def preprocess_for_binary_classification(sample_data, target_class):
     """
     Preprocesses raw data strings for binary classification.
 
-    :param sample_data: List of raw data strings, each containing features and a target label.
+    :param sample_data: List of raw data strings, each containing features and a target label,
+                        or a FeatureStore loaded from a binary feature file.
     :param target_class: The target class of interest for binary classification.
-    :return: Tuple (X, y) where X is the feature matrix and y is the binary target array.
+    :return: Tuple (X, y) where X is the FeatureMatrix and y is the binary target array('l').
     """
-    X = []
-    y = []
+    X, labels = preprocess_for_multiclass_classification(sample_data)
+    # Convert the target label to binary format (1 for target class, -1 for others)
+    y = array('l', [1 if label == target_class else -1 for label in labels])
+    return X, y
+
+def preprocess_for_multiclass_classification(sample_data):
+    """
+    Preprocesses raw data strings, keeping the class labels.
+
+    :param sample_data: List of raw data strings, each containing features and a target label,
+                        or a FeatureStore loaded from a binary feature file.
+    :return: Tuple (X, labels) where X is the FeatureMatrix and labels the stripped class labels.
+    """
+    if isinstance(sample_data, FeatureStore):
+        # Already parsed: use the stored columns as they are
+        return sample_data.X, sample_data.label_list()
+
+    X = FeatureMatrix()
+    labels = []
 
     for line in sample_data:
         parts = line.split(':', 1)
         if len(parts) == 2:
             # Split the line into target label and features
-            target_label, features_str = line.split(':', 1)
+            target_label, features_str = parts
             # Convert features from string to float and strip spaces
             features = [float(feature.strip()) for feature in features_str.split(',')]
             # Append the processed data
-            X.append(features)
-            # Convert the target label to binary format (1 for target class, -1 for others)
-            y.append(1 if target_label.strip() == target_class else -1)
+            X.append_row(features)
+            labels.append(target_label.strip())
         else:
             print("Skipping malformed line:", line)  # Print the malformed line and skip it
 
-    return X, y
+    return X, labels
 
 
 
 def train_test_split(X, y, test_size=0.2):
-    combined = list(zip(X, y))
-    random.shuffle(combined)
-    split_idx = int(len(combined) * (1 - test_size))
-    train_data, test_data = combined[:split_idx], combined[split_idx:]
-    X_train, y_train = zip(*train_data)
-    X_test, y_test = zip(*test_data)
-    return list(X_train), list(y_train), list(X_test), list(y_test)
+    # Shuffle row indices rather than (row, label) pairs; the permutation drawn is the same
+    X = as_feature_matrix(X)
+    order = list(range(len(y)))
+    random.shuffle(order)
+    split_idx = int(len(order) * (1 - test_size))
+    train_idx, test_idx = order[:split_idx], order[split_idx:]
+    y_train = [y[i] for i in train_idx]
+    y_test = [y[i] for i in test_idx]
+    if isinstance(y, array):
+        y_train, y_test = array(y.typecode, y_train), array(y.typecode, y_test)
+    return X.take(train_idx), y_train, X.take(test_idx), y_test
 
 #def save_model_custom(model, filename):
 #    with open(filename, 'w') as file:
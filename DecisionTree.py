@@ -1,13 +1,18 @@
 import math
 import pickle
+from array import array
+from collections import deque
 from loadData import *
+from featureMatrix import SparseFeatureMatrix, as_feature_matrix, encode_labels
+from instrumentation import phase
 class Node:
-    def __init__(self, feature_index=None, threshold=None, value=None, left=None, right=None):
+    def __init__(self, feature_index=None, threshold=None, value=None, left=None, right=None, majority=None):
         self.feature_index = feature_index  # Index of feature to split on
         self.threshold = threshold  # Threshold value for the split
         self.value = value  # Class label for leaf nodes
         self.left = left  # Left subtree
         self.right = right  # Right subtree
+        self.majority = majority  # Label this node would predict if the tree were cut here
 
 def entropy(y):
     # Calculate entropy for a set of labels
@@ -21,41 +26,189 @@ def entropy(y):
 
 def split_dataset(X, y, feature_index, threshold):
     # Split dataset based on a feature and threshold
-    left_X, left_y, right_X, right_y = [], [], [], []
-    for i in range(len(X)):
-        if X[i][feature_index] <= threshold:
-            left_X.append(X[i])
-            left_y.append(y[i])
-        else:
-            right_X.append(X[i])
-            right_y.append(y[i])
-    return left_X, left_y, right_X, right_y
+    X = as_feature_matrix(X)
+    column = X.column(feature_index)
+    left = [i for i in range(len(y)) if column[i] <= threshold]
+    right = [i for i in range(len(y)) if not column[i] <= threshold]
+    return X.take(left), [y[i] for i in left], X.take(right), [y[i] for i in right]
 
-def build_tree(X, y, depth=0, max_depth=None, min_samples_split=2):
-    # Base case: max depth reached or not enough samples to split
-    if max_depth is not None and depth >= max_depth or len(y) < min_samples_split:
-        return Node(value=max(set(y), key=y.count))
+def _entropy_from_counts(counts, total):
+    # Same entropy as entropy(), computed from per-class counts instead of a label list
+    entropy_value = 0.0
+    for count in counts:
+        if count > 0:
+            p = count / total
+            entropy_value -= p * math.log2(p)
+    return entropy_value
+
+def _best_split(columns, y_codes, rows, sorted_rows, n_classes, min_samples_split):
+    # Sweep every presorted feature column once, growing the left class counts as the
+    # threshold moves up. Each unique value is scored exactly like the exhaustive search,
+    # and equal scores are broken in the order the exhaustive search visits thresholds.
+    n = len(rows)
+    total_counts = [0] * n_classes
+    for i in sorted_rows[0]:
+        total_counts[y_codes[i]] += 1
+
+    best_feature, best_threshold, best_score = None, None, float('inf')
+    n_candidates = 0
+    for feature_index, order in enumerate(sorted_rows):
+        column = columns[feature_index]
+        visit_order = {value: rank for rank, value in enumerate(set([column[i] for i in rows]))}
+        n_candidates += len(visit_order)
+        best_rank = None
+        left_counts = [0] * n_classes
+        n_left = 0
+        for pos in range(n):
+            i = order[pos]
+            left_counts[y_codes[i]] += 1
+            n_left += 1
+            threshold = column[i]
+            if pos + 1 < n and column[order[pos + 1]] == threshold:
+                continue  # Only score a threshold once all rows with this value are on the left
+            n_right = n - n_left
+            if n_right < min_samples_split:
+                break  # The right side only shrinks from here on
+            if n_left < min_samples_split:
+                continue
+
+            right_counts = [total - left for total, left in zip(total_counts, left_counts)]
+            impurity = n_left * _entropy_from_counts(left_counts, n_left) + n_right * _entropy_from_counts(right_counts, n_right)
+            if impurity < best_score or (impurity == best_score and best_rank is not None and visit_order[threshold] < best_rank):
+                best_feature, best_threshold, best_score = feature_index, threshold, impurity
+                best_rank = visit_order[threshold]
 
-    num_features = len(X[0])
-    best_feature, best_threshold, best_score, best_sets = None, None, float('inf'), None
+    return best_feature, best_threshold, best_score, n_candidates
 
-    for feature_index in range(num_features):
-        feature_values = set([entry[feature_index] for entry in X])
-        for threshold in feature_values:
-            left_X, left_y, right_X, right_y = split_dataset(X, y, feature_index, threshold)
-            if len(left_y) < min_samples_split or len(right_y) < min_samples_split:
-                continue  # Skip splits that don't satisfy the minimum sample split criterion
+def _grow(columns, y, y_codes, rows, sorted_rows, goes_left, n_classes, depth, max_depth, min_samples_split):
+    node_y = [y[i] for i in rows]
+    if max_depth is not None and depth >= max_depth or len(rows) < min_samples_split:
+        return Node(value=max(set(node_y), key=node_y.count))
 
-            impurity = len(left_y) * entropy(left_y) + len(right_y) * entropy(right_y)
+    with phase('split_search', depth=depth, rows=len(rows)) as timing:
+        best_feature, best_threshold, best_score, n_candidates = _best_split(columns, y_codes, rows, sorted_rows, n_classes, min_samples_split)
+        timing.add(candidates=n_candidates)
+    if best_score == float('inf'):
+        return Node(value=max(set(node_y), key=node_y.count))
+
+    # Partition the row list and every presorted column, keeping their order
+    with phase('partition', depth=depth, rows=len(rows)):
+        column = columns[best_feature]
+        for i in rows:
+            goes_left[i] = column[i] <= best_threshold
+        left_rows = [i for i in rows if goes_left[i]]
+        right_rows = [i for i in rows if not goes_left[i]]
+        left_sorted = [[i for i in order if goes_left[i]] for order in sorted_rows]
+        right_sorted = [[i for i in order if not goes_left[i]] for order in sorted_rows]
+
+    left = _grow(columns, y, y_codes, left_rows, left_sorted, goes_left, n_classes, depth + 1, max_depth, min_samples_split)
+    right = _grow(columns, y, y_codes, right_rows, right_sorted, goes_left, n_classes, depth + 1, max_depth, min_samples_split)
+    return Node(feature_index=best_feature, threshold=best_threshold, left=left, right=right, majority=max(set(node_y), key=node_y.count))
+
+def _best_sparse_split(features, y_codes, rows, n_classes, min_samples_split):
+    # Same sweep as _best_split over the non-zero entries of each feature only. The rows a
+    # feature has no entry for hold 0: they form one block, placed between the negative and
+    # positive values, whose class counts are the node totals minus the non-zero counts.
+    # Equal scores keep the first feature and lowest threshold.
+    n = len(rows)
+    total_counts = [0] * n_classes
+    for i in rows:
+        total_counts[y_codes[i]] += 1
+
+    best_feature, best_threshold, best_score = None, None, float('inf')
+    n_candidates = 0
+    for feature_index, entries in features.items():
+        nnz = len(entries)
+        n_zero = n - nnz
+        zero_counts = list(total_counts)
+        for i, _ in entries:
+            zero_counts[y_codes[i]] -= 1
+        left_counts = [0] * n_classes
+        n_left = 0
+        pos = 0
+        while True:
+            if n_zero and (pos == nnz or entries[pos][1] > 0):
+                # Implicit zero block
+                threshold = 0.0
+                left_counts = [left + zero for left, zero in zip(left_counts, zero_counts)]
+                n_left += n_zero
+                n_zero = 0
+            elif pos == nnz:
+                break
+            else:
+                threshold = entries[pos][1]
+                while pos < nnz and entries[pos][1] == threshold:
+                    left_counts[y_codes[entries[pos][0]]] += 1
+                    n_left += 1
+                    pos += 1
+            n_candidates += 1
+            n_right = n - n_left
+            if n_right < min_samples_split:
+                break  # The right side only shrinks from here on
+            if n_left < min_samples_split:
+                continue
+
+            right_counts = [total - left for total, left in zip(total_counts, left_counts)]
+            impurity = n_left * _entropy_from_counts(left_counts, n_left) + n_right * _entropy_from_counts(right_counts, n_right)
             if impurity < best_score:
-                best_feature, best_threshold, best_score, best_sets = feature_index, threshold, impurity, (left_X, left_y, right_X, right_y)
+                best_feature, best_threshold, best_score = feature_index, threshold, impurity
+
+    return best_feature, best_threshold, best_score, n_candidates
+
+def _grow_sparse(features, y, y_codes, rows, goes_left, n_classes, depth, max_depth, min_samples_split):
+    # _grow for a SparseFeatureMatrix; features maps each feature with non-zero entries in
+    # this node to its (row, value) entries sorted by value
+    node_y = [y[i] for i in rows]
+    if max_depth is not None and depth >= max_depth or len(rows) < min_samples_split:
+        return Node(value=max(set(node_y), key=node_y.count))
 
+    with phase('split_search', depth=depth, rows=len(rows)) as timing:
+        best_feature, best_threshold, best_score, n_candidates = _best_sparse_split(features, y_codes, rows, n_classes, min_samples_split)
+        timing.add(candidates=n_candidates)
     if best_score == float('inf'):
-        return Node(value=max(set(y), key=y.count))
+        return Node(value=max(set(node_y), key=node_y.count))
 
-    left = build_tree(*best_sets[0:2], depth=depth + 1, max_depth=max_depth, min_samples_split=min_samples_split)
-    right = build_tree(*best_sets[2:4], depth=depth + 1, max_depth=max_depth, min_samples_split=min_samples_split)
-    return Node(feature_index=best_feature, threshold=best_threshold, left=left, right=right)
+    # Partition the rows and the entries of every feature, keeping their order
+    with phase('partition', depth=depth, rows=len(rows)):
+        zero_goes_left = 0.0 <= best_threshold
+        for i in rows:
+            goes_left[i] = zero_goes_left
+        for i, value in features[best_feature]:
+            goes_left[i] = value <= best_threshold
+        left_rows = [i for i in rows if goes_left[i]]
+        right_rows = [i for i in rows if not goes_left[i]]
+        left_features, right_features = {}, {}
+        for feature_index, entries in features.items():
+            left_entries = [entry for entry in entries if goes_left[entry[0]]]
+            if left_entries:
+                left_features[feature_index] = left_entries
+            if len(left_entries) < len(entries):
+                right_features[feature_index] = [entry for entry in entries if not goes_left[entry[0]]]
+
+    left = _grow_sparse(left_features, y, y_codes, left_rows, goes_left, n_classes, depth + 1, max_depth, min_samples_split)
+    right = _grow_sparse(right_features, y, y_codes, right_rows, goes_left, n_classes, depth + 1, max_depth, min_samples_split)
+    return Node(feature_index=best_feature, threshold=best_threshold, left=left, right=right, majority=max(set(node_y), key=node_y.count))
+
+def build_tree(X, y, depth=0, max_depth=None, min_samples_split=2):
+    # Each feature column is sorted once here; nodes then find their best split with a
+    # single cumulative-count sweep per feature instead of re-splitting for every threshold.
+    # Nodes only carry row indices into X, never copies of the rows themselves.
+    # A SparseFeatureMatrix is searched over its non-zero entries only.
+    with phase('build_tree', rows=len(y), max_depth=max_depth, min_samples_split=min_samples_split):
+        X = as_feature_matrix(X)
+        if isinstance(X, SparseFeatureMatrix):
+            y_codes, classes = encode_labels(y)
+            with phase('presort', rows=len(y)):
+                features = {}
+                for feature_index in X.nonzero_features():
+                    features[feature_index] = sorted(zip(*X.column_entries(feature_index)), key=lambda entry: entry[1])
+            return _grow_sparse(features, y, y_codes, list(range(len(y))), bytearray(len(y)), len(classes), depth, max_depth, min_samples_split)
+        y_codes, classes = encode_labels(y)
+        rows = list(range(len(y)))
+        with phase('presort', rows=len(y)):
+            sorted_rows = [sorted(rows, key=column.__getitem__) for column in X.columns]
+        goes_left = bytearray(len(y))
+        return _grow(X.columns, y, y_codes, rows, sorted_rows, goes_left, len(classes), depth, max_depth, min_samples_split)
 
 
 def print_tree(node, depth=0):
@@ -79,23 +232,152 @@ def predict(tree, data_point):
         else:
             return predict(tree.right, data_point)
 
+class CompiledTree:
+    """
+    Decision tree flattened into parallel arrays, built by compile_tree.
+
+    Node k splits on feature_index[k] <= threshold[k] and continues at left[k] or right[k];
+    leaves have feature_index -1 and predict classes[value[k]]. Node 0 is the root.
+    """
+    def __init__(self, feature_index, threshold, left, right, value, classes):
+        self.feature_index = feature_index
+        self.threshold = threshold
+        self.left = left
+        self.right = right
+        self.value = value
+        self.classes = classes
+
+    def __len__(self):
+        return len(self.feature_index)
+
+    def predict(self, X):
+        # Route the whole batch down one level at a time; each node filters its rows on one column
+        X = as_feature_matrix(X)
+        predictions = [None] * len(X)
+        frontier = [(0, range(len(X)))]
+        while frontier:
+            next_frontier = []
+            for node, rows in frontier:
+                feature_index = self.feature_index[node]
+                if feature_index < 0:
+                    label = self.classes[self.value[node]]
+                    for i in rows:
+                        predictions[i] = label
+                    continue
+                column = X.column(feature_index)
+                threshold = self.threshold[node]
+                left_rows = [i for i in rows if column[i] <= threshold]
+                right_rows = [i for i in rows if not column[i] <= threshold]
+                if left_rows:
+                    next_frontier.append((self.left[node], left_rows))
+                if right_rows:
+                    next_frontier.append((self.right[node], right_rows))
+            frontier = next_frontier
+        return predictions
+
+def compile_tree(tree):
+    # Flatten a Node tree breadth first into a CompiledTree, without recursion
+    feature_index, threshold, left, right, value = array('l'), array('d'), array('l'), array('l'), array('l')
+    classes, class_codes = [], {}
+    queue = deque([tree])
+    while queue:
+        node = queue.popleft()
+        if node.value is not None:
+            if node.value not in class_codes:
+                class_codes[node.value] = len(classes)
+                classes.append(node.value)
+            feature_index.append(-1)
+            threshold.append(0.0)
+            left.append(-1)
+            right.append(-1)
+            value.append(class_codes[node.value])
+        else:
+            child = len(feature_index) + len(queue) + 1  # Ids follow breadth-first order
+            feature_index.append(node.feature_index)
+            threshold.append(node.threshold)
+            left.append(child)
+            right.append(child + 1)
+            value.append(-1)
+            queue.append(node.left)
+            queue.append(node.right)
+    return CompiledTree(feature_index, threshold, left, right, value, classes)
+
+def predict_batch(tree, X):
+    """
+    Predicts every row of X with a decision tree.
+
+    :param tree: Root Node or CompiledTree.
+    :param X: FeatureMatrix or list of feature rows.
+    :return: List of predicted labels, one per row.
+    """
+    if not isinstance(tree, CompiledTree):
+        tree = compile_tree(tree)
+    return tree.predict(X)
+
+# A split never depends on max_depth, so a tree grown to a smaller depth is the deeper tree
+# with every node at that depth turned into a leaf predicting the node's majority label.
+def truncate_tree(tree, max_depth, depth=0):
+    if tree.value is not None or max_depth is None:
+        return tree
+    if depth >= max_depth:
+        return Node(value=tree.majority)
+    return Node(feature_index=tree.feature_index, threshold=tree.threshold,
+                left=truncate_tree(tree.left, max_depth, depth + 1),
+                right=truncate_tree(tree.right, max_depth, depth + 1),
+                majority=tree.majority)
+
+# Predictions of the tree cut at each of max_depths, from a single walk down the full tree
+def predict_at_depths(tree, data_point, max_depths):
+    predictions = {}
+    node, depth = tree, 0
+    while node.value is None:
+        if depth in max_depths:
+            predictions[depth] = node.majority
+        if data_point[node.feature_index] <= node.threshold:
+            node = node.left
+        else:
+            node = node.right
+        depth += 1
+    for max_depth in max_depths:
+        predictions.setdefault(max_depth, node.value)
+    return predictions
+
+def depth_accuracies(tree, X_val, y_val, max_depth_values):
+    # Validation accuracy of the tree cut at every value of max_depth_values
+    correct = {max_depth: 0 for max_depth in max_depth_values}
+    for x, label in zip(X_val, y_val):
+        for max_depth, prediction in predict_at_depths(tree, x, correct).items():
+            if prediction == label:
+                correct[max_depth] += 1
+    return {max_depth: count / len(y_val) for max_depth, count in correct.items()}
+
 def hyperparameter_tuning(X_train, y_train, X_val, y_val, max_depth_values, min_samples_split_values):
     best_max_depth = None
     best_min_samples_split = None
     best_accuracy = float('-inf')
     best_tree = None
 
+    # Grow one tree per min_samples_split to the largest depth and score every depth cut-off from it
+    deepest = None if None in max_depth_values else max(max_depth_values)
+    X_train = as_feature_matrix(X_train)
+    full_trees, accuracies = {}, {}
+    for min_samples_split in min_samples_split_values:
+        with phase('grid_point', min_samples_split=min_samples_split):
+            tree = build_tree(X_train, y_train, max_depth=deepest, min_samples_split=min_samples_split)
+            full_trees[min_samples_split] = tree
+            with phase('validation', rows=len(y_val)):
+                for max_depth, accuracy in depth_accuracies(tree, X_val, y_val, max_depth_values).items():
+                    accuracies[max_depth, min_samples_split] = accuracy
+
     for max_depth in max_depth_values:
         for min_samples_split in min_samples_split_values:
-            tree = build_tree(X_train, y_train, max_depth=max_depth, min_samples_split=min_samples_split)
-            predictions = [predict(tree, x) for x in X_val]
-            accuracy = sum(1 for i in range(len(y_val)) if y_val[i] == predictions[i]) / len(y_val)
+            accuracy = accuracies[max_depth, min_samples_split]
 
             if accuracy > best_accuracy:
                 best_max_depth = max_depth
                 best_min_samples_split = min_samples_split
                 best_accuracy = accuracy
-                best_tree = tree
+                best_tree = truncate_tree(full_trees[min_samples_split], max_depth)
 
     return best_max_depth, best_min_samples_split, best_accuracy, best_tree
 
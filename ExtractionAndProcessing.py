@@ -1,10 +1,13 @@
 # -*- coding: utf-8 -*-
 
-import json
 import random
 import argparse
 import string
 
+from fusedFeatures import extract_features
+from parseWikiDump import iter_abstracts_from_json
+from reservoirSampling import Reservoir
+
 vowels = "aeiouAEIOU\u00E0\u00E8\u00E9\u00EC\u00ED\u00F2\u00F3\u00F9\u00FA\u00C0\u00C8\u00C9\u00CC\u00CD\u00D2\u00D3\u00D9\u00DA"
 
 def calculate_vowel_consonant_ratio(text):
@@ -70,53 +73,56 @@ def max_and_average_consonant_chain_lengths(text):
     return normalized_max_chain_length, average_chain_length
 
 
-def extract_and_process_segments(input_json, output_file, language, segment_lengths, max_data_points):
-    # Read the JSON file containing abstracts
-    with open(input_json, 'r', encoding='utf-8') as json_file:
-        data = json.load(json_file)
-        abstracts = [item['abstract'] for item in data]
+remove_punct_trans = str.maketrans('', '', string.punctuation)
+
+def process_abstract(abstract, language, segment_lengths):
+    # Yields (length, feature line) for every segment of the abstract that passes cleaning
+    words = abstract.split()
+    for length in segment_lengths:
+        if len(words) >= length:
+            segment = ' '.join(words[:length])
+            processed_segment = segment.translate(remove_punct_trans).strip()
+
+            # Perform feature extraction in a single pass, then drop outliers
+            vcratio, wvc, mwl, awl, mccl, accl = extract_features(processed_segment)
+            if vcratio is None:
+                continue
+            if mwl > 30:
+                continue
+            yield length, f"{language}: {vcratio}, {wvc}, {mwl}, {awl}, {mccl}, {accl}\n"
+
+def extract_and_process_segments(input_json, output_file, language, segment_lengths, max_data_points, seed=None):
+    """
+    Samples segments from an abstracts file and writes their features.
+
+    Abstracts are streamed from a JSON or NDJSON file and every length keeps a seeded
+    reservoir of at most max_data_points cleaned segments, so the sample is uniform over the
+    whole file while memory stays O(max_data_points).
 
-    random.shuffle(abstracts)
-    remove_punct_trans = str.maketrans('', '', string.punctuation)
+    :param seed: Seed of the sampling; the same seed and input give the same output.
+    """
+    rng = random.Random(seed)
 
-    data_counters = {length: 0 for length in segment_lengths}
+    reservoirs = {length: Reservoir(max_data_points, rng) for length in segment_lengths}
+    for position, item in enumerate(iter_abstracts_from_json(input_json)):
+        for length, line in process_abstract(item['abstract'], language, segment_lengths):
+            reservoirs[length].add((position, line))
 
-                
+    # Write features to output file, in the order the abstracts appear in the input
+    sampled = sorted(entry for reservoir in reservoirs.values() for entry in reservoir.items)
     with open(output_file, "w", encoding="utf-8") as outfile:
-        for abstract in abstracts:
-            words = abstract.split()
-            for length in segment_lengths:
-                if len(words) >= length and data_counters[length] < max_data_points:
-                    segment = ' '.join(words[:length])
-                    processed_segment = segment.translate(remove_punct_trans).strip()
-
-                    # Perform feature extraction
-                    vcratio = calculate_vowel_consonant_ratio(processed_segment)
-                    if vcratio is None:
-                        continue  
-                    mwl, awl = max_and_average_word_length(processed_segment)
-                    if mwl > 30:
-                        continue
-                    wvc = count_words_ending_with_vowels_normalized(processed_segment)
-                    mwl, awl = max_and_average_word_length(processed_segment)
-                    mccl, accl = max_and_average_consonant_chain_lengths(processed_segment)
-
-                    # Write features to output file
-                    outfile.write(f"{language}: {vcratio}, {wvc}, {mwl}, {awl}, {mccl}, {accl}\n")
-                    data_counters[length] += 1
-
-                # Check if we have collected enough data for each length
-                if all(count >= max_data_points for count in data_counters.values()):
-                    return  # Stop processing further data
+        for _, line in sampled:
+            outfile.write(line)
     
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Extract text segments and perform feature extraction.")
-    parser.add_argument("input_json", help="Input JSON file containing abstracts")
+    parser.add_argument("input_json", help="Input JSON or NDJSON file containing abstracts")
     parser.add_argument("output_file", help="Output file for extracted features")
     parser.add_argument("language", help="Language code (e.g., 'en')")
     parser.add_argument("max_data_points", type=int, help="Maximum number of data points to collect")
+    parser.add_argument("--seed", type=int, default=None, help="Random seed for reproducible sampling")
 
     args = parser.parse_args()
 
-    extract_and_process_segments(args.input_json, args.output_file, args.language, [50, 20, 10], args.max_data_points)
+    extract_and_process_segments(args.input_json, args.output_file, args.language, [50, 20, 10], args.max_data_points, seed=args.seed)
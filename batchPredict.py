@@ -0,0 +1,178 @@
+import hashlib
+import io
+import json
+import mmap
+import multiprocessing
+import os
+import tempfile
+from collections import deque
+
+from modelFormat import load_model_file, write_model_file
+from instrumentation import phase
+
+# Batch prediction over one large file. The input is memory-mapped and cut into chunks of
+# about chunk_bytes that end on a line break; each chunk is read, featurized and scored by
+# a worker and the predictions are written in input order. At most max_in_flight chunks are
+# queued or buffered at a time, so memory does not grow with the file. After every written
+# chunk a checkpoint records how far input and output have got, and an interrupted run with
+# the same input, model and chunk size continues from there.
+
+CHECKPOINT_VERSION = 1
+
+# Model, scoring function and mapped input of a worker process, see _init_worker
+_worker = None
+
+def chunk_bounds(mapped, start, chunk_bytes):
+    # Line-aligned (start, end) byte ranges from start to the end of the mapped file
+    size = len(mapped)
+    while start < size:
+        end = start + chunk_bytes
+        if end >= size:
+            end = size
+        else:
+            newline = mapped.find(b'\n', end - 1)
+            end = size if newline < 0 else newline + 1
+        yield start, end
+        start = end
+
+def _init_worker(model_path, input_path, predict_lines, batch_lines):
+    global _worker
+    model = load_model_file(model_path)
+    with open(input_path, 'rb') as file:
+        mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    _worker = (model, mapped, predict_lines, batch_lines)
+
+def _predict_chunk(bounds):
+    # Predictions of one chunk as the bytes to write, and its number of lines
+    start, end = bounds
+    model, mapped, predict_lines, batch_lines = _worker
+    # Text-mode newline handling, so lines are split exactly as when iterating over the open file
+    lines = io.StringIO(mapped[start:end].decode('utf-8'), newline=None)
+    with phase('predict_chunk', start=start, bytes=end - start) as timing:
+        predictions = [prediction for chunk in predict_lines(model, lines, batch_lines) for prediction in chunk]
+        timing.add(rows=len(predictions))
+    return ''.join(str(prediction) + '\n' for prediction in predictions).encode('utf-8'), len(predictions)
+
+def _load_checkpoint(path, expected):
+    # Saved progress, if it belongs to the same input, model and chunking
+    try:
+        with open(path, 'r', encoding='utf-8') as file:
+            checkpoint = json.load(file)
+    except (FileNotFoundError, ValueError):
+        return None
+    if any(checkpoint.get(key) != value for key, value in expected.items()):
+        return None
+    return checkpoint
+
+def _output_size(path):
+    try:
+        return os.path.getsize(path)
+    except FileNotFoundError:
+        return -1
+
+def _save_checkpoint(path, checkpoint):
+    temporary = path + f'.{os.getpid()}.tmp'
+    with open(temporary, 'w', encoding='utf-8') as file:
+        json.dump(checkpoint, file)
+    os.replace(temporary, path)
+
+def batch_predict(model, input_path, output_path, predict_lines, workers=None, chunk_bytes=1 << 22,
+                  batch_lines=4096, max_in_flight=None, resume=True):
+    """
+    Predicts every line of a large file on a process pool, writing the predictions in order.
+
+    :param model: ModelFile to predict with; workers map a copy of it written next to the output.
+    :param input_path: Text file with one segment per line.
+    :param output_path: Prediction file, one line per input line as predict_all writes it.
+    :param predict_lines: Function (model, lines, chunk_size) yielding prediction lists, e.g.
+                          wiki.predict_lines.
+    :param workers: Number of worker processes, default the number of CPUs; 1 runs in this process.
+    :param chunk_bytes: Approximate input bytes per task.
+    :param batch_lines: Lines featurized and scored together inside a task.
+    :param max_in_flight: Maximum chunks submitted but not yet written, default twice the workers.
+    :param resume: Continue from output_path + '.checkpoint' when it matches this run.
+    :return: Number of lines predicted by this call.
+    """
+    global _worker
+    workers = workers or os.cpu_count() or 1
+    max_in_flight = max_in_flight or 2 * workers
+    checkpoint_path = output_path + '.checkpoint'
+
+    # Workers load the model from a binary file, whatever it was loaded from here
+    directory = os.path.dirname(os.path.abspath(output_path))
+    handle, model_path = tempfile.mkstemp(suffix='.lrm', dir=directory)
+    os.close(handle)
+    try:
+        write_model_file(model_path, model.models[0] if model.kind == 'tree' else model.models, model.classes)
+        with open(model_path, 'rb') as file:
+            model_hash = hashlib.sha256(file.read()).hexdigest()
+        stat = os.stat(input_path)
+        expected = {
+            'version': CHECKPOINT_VERSION,
+            'input': os.path.abspath(input_path),
+            'input_stamp': [stat.st_mtime_ns, stat.st_size],
+            'model': model_hash,
+            'chunk_bytes': chunk_bytes,
+        }
+        checkpoint = _load_checkpoint(checkpoint_path, expected) if resume else None
+        if checkpoint is not None and _output_size(output_path) < checkpoint['output_offset']:
+            checkpoint = None  # The output written so far is gone or cut short; start over
+        if checkpoint is None:
+            checkpoint = dict(expected, input_offset=0, output_offset=0, lines=0)
+        start_lines = checkpoint['lines']
+
+        if stat.st_size == 0:
+            open(output_path, 'wb').close()  # An empty file cannot be mapped
+            if os.path.exists(checkpoint_path):
+                os.remove(checkpoint_path)
+            return 0
+
+        with open(output_path, 'r+b' if checkpoint['output_offset'] else 'wb') as output:
+            output.truncate(checkpoint['output_offset'])  # Drop anything written after the checkpoint
+            output.seek(checkpoint['output_offset'])
+            with open(input_path, 'rb') as file:
+                mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                with phase('batch_predict', workers=workers, bytes=stat.st_size - checkpoint['input_offset']) as timing:
+                    bounds = chunk_bounds(mapped, checkpoint['input_offset'], chunk_bytes)
+                    initargs = (model_path, input_path, predict_lines, batch_lines)
+                    if workers <= 1:
+                        _init_worker(*initargs)
+                        results = ((end, _predict_chunk((start, end))) for start, end in bounds)
+                        _write_results(results, output, checkpoint, checkpoint_path)
+                    else:
+                        # fork shares the parent's imports; workers map the same model and input pages
+                        methods = multiprocessing.get_all_start_methods()
+                        context = multiprocessing.get_context('fork' if 'fork' in methods else None)
+                        with context.Pool(workers, initializer=_init_worker, initargs=initargs) as pool:
+                            _write_results(_ordered(pool, bounds, max_in_flight), output, checkpoint, checkpoint_path)
+                    timing.add(rows=checkpoint['lines'] - start_lines)
+            finally:
+                mapped.close()
+        os.remove(checkpoint_path)
+        return checkpoint['lines'] - start_lines
+    finally:
+        _worker = None
+        os.remove(model_path)
+
+def _ordered(pool, bounds, max_in_flight):
+    # (input end, result) of every chunk in input order, with at most max_in_flight outstanding
+    in_flight = deque()
+    for start, end in bounds:
+        if len(in_flight) == max_in_flight:
+            chunk_end, result = in_flight.popleft()
+            yield chunk_end, result.get()
+        in_flight.append((end, pool.apply_async(_predict_chunk, ((start, end),))))
+    while in_flight:
+        chunk_end, result = in_flight.popleft()
+        yield chunk_end, result.get()
+
+def _write_results(results, output, checkpoint, checkpoint_path):
+    for input_end, (data, n_lines) in results:
+        output.write(data)
+        output.flush()
+        os.fsync(output.fileno())
+        checkpoint['input_offset'] = input_end
+        checkpoint['output_offset'] += len(data)
+        checkpoint['lines'] += n_lines
+        _save_checkpoint(checkpoint_path, checkpoint)
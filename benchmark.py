@@ -0,0 +1,238 @@
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from xml.sax.saxutils import escape
+
+from DecisionTree import build_tree, compile_tree, hyperparameter_tuning
+from AdaBoostWithStumps import AdaBoost, OneVsAllAdaBoost, train_test_split
+from fusedFeatures import extract_feature_matrix
+from parseWikiDump import parse_abstracts
+from wiki import predict_multiclass
+
+# Syllables per language, chosen so the synthetic segments differ the way the real ones do:
+# open vowel-final syllables for Italian, consonant clusters and double vowels for Dutch
+_SYLLABLES = {
+    'it': ['ca', 'to', 're', 'la', 'mi', 'no', 'di', 'ta', 'so', 'pe', 'gli', 'zio', 'ne', 'ri', 'co', 'va', 'be', 'là', 'tà', 'per', 'con'],
+    'nl': ['de', 'het', 'een', 'van', 'sch', 'oor', 'ijk', 'ge', 'aan', 'stra', 'ten', 'ver', 'hui', 'zen', 'kla', 'nk', 'oe', 'wij', 'dt', 'ee', 'lijk'],
+    'en': ['the', 'ing', 'and', 'th', 'er', 'tion', 'ch', 'ou', 'ed', 'ly', 'wh', 'ere', 'st', 'ro', 'ght', 'sh', 'ay', 'in', 'on', 'es', 'be'],
+}
+LANGUAGES = ('it', 'nl', 'en')
+SEGMENT_LENGTHS = (10, 20, 50)
+
+def synthetic_segments(n, seed=0, languages=LANGUAGES):
+    """
+    Deterministic synthetic multilingual segments.
+
+    :param n: Number of segments, spread evenly over the languages and segment lengths.
+    :param seed: Seed of the generator; the same seed always gives the same segments.
+    :return: Tuple (segments, labels).
+    """
+    rng = random.Random(seed)
+    segments, labels = [], []
+    for i in range(n):
+        language = languages[i % len(languages)]
+        syllables = _SYLLABLES[language]
+        n_words = SEGMENT_LENGTHS[(i // len(languages)) % len(SEGMENT_LENGTHS)]
+        words = [''.join(rng.choice(syllables) for _ in range(rng.randint(1, 3))) for _ in range(n_words)]
+        segments.append(' '.join(words))
+        labels.append(language)
+    return segments, labels
+
+def write_synthetic_dump(path, segments):
+    # Abstracts dump in the Wikipedia layout parse_abstracts reads
+    with open(path, 'w', encoding='utf-8') as file:
+        file.write('<feed>\n')
+        for i, segment in enumerate(segments):
+            file.write(f'<doc>\n<title>Wikipedia: Article {i}</title>\n<url>https://example.org/wiki/{i}</url>\n'
+                       f'<abstract>{escape(segment)}</abstract>\n<links></links>\n</doc>\n')
+        file.write('</feed>\n')
+
+def _peak_rss_mb():
+    # High-water mark of the whole process, never reset; ru_maxrss is in KiB on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1 << 20) if sys.platform == 'darwin' else peak / (1 << 10)
+
+def _git_commit():
+    root = os.path.dirname(os.path.abspath(__file__))
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=root, capture_output=True, text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=root, capture_output=True, text=True, check=True).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+    return commit, dirty
+
+# Benchmarks in run order; each takes the shared state of one size and may add to it
+def _bench_parse(state):
+    state['abstracts'] = parse_abstracts(state['dump'])
+
+def _bench_extract(state):
+    state['X'] = extract_feature_matrix(state['segments'])
+
+def _bench_build_tree(state):
+    state['tree'] = build_tree(state['X'], state['labels'], max_depth=5, min_samples_split=max(2, len(state['labels']) // 100))
+
+def _bench_adaboost_fit(state):
+    model = AdaBoost(n_learners=10)
+    model.fit(state['X'], [1 if label == 'it' else -1 for label in state['labels']])
+    state['adaboost'] = model
+
+def _bench_tuning(state):
+    X_train, y_train, X_val, y_val = state['split']
+    n = len(y_train)
+    hyperparameter_tuning(X_train, y_train, X_val, y_val, [3, 4, 5], [max(2, int(n * p)) for p in (0.01, 0.02, 0.05)])
+
+def _bench_predict(state):
+    state['tree_compiled'].predict(state['X'])
+
+def _bench_predict_multiclass(state):
+    predict_multiclass(state['one_vs_all'].models, state['X'], LANGUAGES)
+
+BENCHMARKS = [
+    ('parse_abstracts', _bench_parse),
+    ('extract_features', _bench_extract),
+    ('build_tree', _bench_build_tree),
+    ('adaboost_fit', _bench_adaboost_fit),
+    ('hyperparameter_tuning', _bench_tuning),
+    ('predict', _bench_predict),
+    ('predict_multiclass', _bench_predict_multiclass),
+]
+
+def _prepare(state, name):
+    # Untimed inputs a benchmark needs that an earlier benchmark did not produce
+    if name not in ('parse_abstracts', 'extract_features') and 'X' not in state:
+        _bench_extract(state)
+    if name == 'hyperparameter_tuning' and 'split' not in state:
+        random.seed(0)
+        state['split'] = train_test_split(state['X'], state['labels'])
+    elif name == 'predict' and 'tree_compiled' not in state:
+        if 'tree' not in state:
+            _bench_build_tree(state)
+        state['tree_compiled'] = compile_tree(state['tree'])
+    elif name == 'predict_multiclass' and 'one_vs_all' not in state:
+        state['one_vs_all'] = OneVsAllAdaBoost(LANGUAGES, n_learners=10)
+        state['one_vs_all'].fit(state['X'], state['labels'])
+
+def run_benchmarks(sizes, names=None, repeat=1, memory=False, seed=0, work_dir=None):
+    """
+    Times every benchmark at every size.
+
+    :param sizes: Numbers of rows (segments, abstracts) to run at.
+    :param names: Benchmarks to run, default all; prerequisites are still computed untimed.
+    :param repeat: Timed runs per benchmark; the fastest is reported.
+    :param memory: Also run each benchmark once under tracemalloc for its peak allocation.
+    :param seed: Seed of the synthetic data.
+    :return: List of result dicts, one per benchmark and size.
+    """
+    names = set(names or [name for name, _ in BENCHMARKS])
+    results = []
+    with tempfile.TemporaryDirectory(dir=work_dir) as directory:
+        for n in sizes:
+            segments, labels = synthetic_segments(n, seed)
+            state = {'segments': segments, 'labels': labels, 'dump': os.path.join(directory, f'dump_{n}.xml')}
+            if 'parse_abstracts' in names:
+                write_synthetic_dump(state['dump'], segments)
+            for name, bench in BENCHMARKS:
+                if name not in names:
+                    continue
+                _prepare(state, name)
+                timings = []
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    bench(state)
+                    timings.append(time.perf_counter() - start)
+                seconds = min(timings)
+                result = {
+                    'name': name,
+                    'rows': n,
+                    'seconds': seconds,
+                    'rows_per_second': n / seconds if seconds > 0 else None,
+                }
+                if memory:
+                    tracemalloc.start()
+                    bench(state)
+                    result['peak_alloc_mb'] = tracemalloc.get_traced_memory()[1] / (1 << 20)
+                    tracemalloc.stop()
+                results.append(result)
+                print(f"{name:>22} {n:>9} rows {seconds:10.4f} s", file=sys.stderr)
+            if os.path.exists(state['dump']):
+                os.remove(state['dump'])
+    return results
+
+def scaling(results):
+    # Empirical exponent k of time ~ rows^k between consecutive sizes; about 1 is linear, 2 quadratic
+    curves = {}
+    by_name = {}
+    for result in results:
+        by_name.setdefault(result['name'], []).append(result)
+    for name, points in by_name.items():
+        points.sort(key=lambda result: result['rows'])
+        curves[name] = [
+            {'from': a['rows'], 'to': b['rows'], 'exponent': math.log(b['seconds'] / a['seconds']) / math.log(b['rows'] / a['rows'])}
+            for a, b in zip(points, points[1:]) if a['seconds'] > 0 and b['seconds'] > 0
+        ]
+    return curves
+
+def compare(report, baseline, tolerance=0.25):
+    """
+    Slowdowns of a report against a baseline report from another commit.
+
+    :param tolerance: Allowed relative slowdown before a benchmark counts as a regression.
+    :return: List of (name, rows, ratio) for every benchmark slower than allowed.
+    """
+    baseline_seconds = {(result['name'], result['rows']): result['seconds'] for result in baseline['results']}
+    regressions = []
+    for result in report['results']:
+        before = baseline_seconds.get((result['name'], result['rows']))
+        if before:
+            ratio = result['seconds'] / before
+            if ratio > 1 + tolerance:
+                regressions.append((result['name'], result['rows'], ratio))
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark extraction, training and prediction on synthetic multilingual segments.")
+    parser.add_argument("--sizes", type=int, nargs='+', default=[1000, 10000, 100000], help="Numbers of rows, e.g. 1000 10000 100000 1000000")
+    parser.add_argument("--only", nargs='+', choices=[name for name, _ in BENCHMARKS], default=None, help="Benchmarks to run, default all")
+    parser.add_argument("--repeat", type=int, default=1, help="Timed runs per benchmark; the fastest is reported")
+    parser.add_argument("--memory", action='store_true', help="Also measure the peak Python allocation of each benchmark with tracemalloc")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the synthetic data")
+    parser.add_argument("--output", default=None, help="JSON report file, default is standard output")
+    parser.add_argument("--baseline", default=None, help="Earlier JSON report to compare against; exits with status 1 on regressions")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed relative slowdown against the baseline")
+    args = parser.parse_args()
+
+    commit, dirty = _git_commit()
+    results = run_benchmarks(args.sizes, args.only, args.repeat, args.memory, args.seed)
+    report = {
+        'commit': commit,
+        'dirty': dirty,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'seed': args.seed,
+        'peak_rss_mb': _peak_rss_mb(),  # Whole run; per-benchmark memory is peak_alloc_mb from --memory
+        'results': results,
+        'scaling': scaling(results),
+    }
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            json.dump(report, file, indent=4)
+    else:
+        print(json.dumps(report, indent=4))
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as file:
+            regressions = compare(report, json.load(file), args.tolerance)
+        for name, rows, ratio in regressions:
+            print(f"Regression: {name} at {rows} rows is {ratio:.2f}x slower than the baseline", file=sys.stderr)
+        sys.exit(1 if regressions else 0)
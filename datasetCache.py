@@ -0,0 +1,183 @@
+import hashlib
+import json
+import os
+import random
+import shutil
+from collections import OrderedDict
+
+from AdaBoostWithStumps import preprocess_for_multiclass_classification
+from featureStore import FeatureStore, load_feature_store, write_feature_store
+from instrumentation import phase
+from outOfCore import file_hash
+
+FORMAT_VERSION = 1
+SOURCES = 'sources.json'
+
+def lines_hash(lines):
+    # Content hash of raw data already in memory, e.g. the lines from load_data()
+    digest = hashlib.sha256()
+    for line in lines:
+        digest.update(line.encode('utf-8'))
+    return digest.hexdigest()
+
+def store_hash(store):
+    # Content hash of a FeatureStore: labels, feature columns and label codes as stored
+    digest = hashlib.sha256(json.dumps(store.labels).encode('utf-8'))
+    for column in store.X.columns:
+        digest.update(column)
+    digest.update(store.label_codes)
+    return digest.hexdigest()
+
+class DatasetSplit:
+    """
+    Sampled, parsed and split training data, as stored in the cache.
+
+    train and test are FeatureStores memory-mapped from the cache directory; key identifies
+    the data (see DatasetCache.key).
+    """
+    def __init__(self, key, train, test):
+        self.key = key
+        self.train = train
+        self.test = test
+
+    def arrays(self):
+        # (X_train, labels_train, X_test, labels_test), the way split_data and train_test_split return them
+        return self.train.X, self.train.label_list(), self.test.X, self.test.label_list()
+
+    def close(self):
+        self.train.close()
+        self.test.close()
+
+class DatasetCache:
+    """
+    Content-addressed cache of sampled, parsed and split datasets.
+
+    A split is identified by the hash of its source data, the sample size, the seed, the
+    test fraction and the label mapping, so the same inputs always give the same rows and
+    a changed source file gives a new entry. Each entry is a directory with the train and
+    test rows as binary feature files, which are memory-mapped when loaded; recently used
+    splits are also kept in an in-process LRU cache.
+
+    :param root: Cache directory, created on the first write.
+    :param cache_size: Number of loaded splits kept in memory.
+    """
+    def __init__(self, root='.dataset_cache', cache_size=4):
+        self.root = root
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+
+    def source_hash(self, path):
+        # File hash, remembered per path with its modification time and size so an unchanged
+        # file is not read again
+        sources_path = os.path.join(self.root, SOURCES)
+        try:
+            with open(sources_path, 'r', encoding='utf-8') as file:
+                sources = json.load(file)
+        except (FileNotFoundError, ValueError):
+            sources = {}
+        stat = os.stat(path)
+        stamp = [stat.st_mtime_ns, stat.st_size]
+        path = os.path.abspath(path)
+        if path in sources and sources[path]['stamp'] == stamp:
+            return sources[path]['hash']
+
+        source = file_hash(path)
+        sources[path] = {'stamp': stamp, 'hash': source}
+        os.makedirs(self.root, exist_ok=True)
+        temporary = sources_path + f'.{os.getpid()}.tmp'
+        with open(temporary, 'w', encoding='utf-8') as file:
+            json.dump(sources, file, indent=4)
+        os.replace(temporary, sources_path)
+        return source
+
+    @staticmethod
+    def key(source_hash, sample_size, seed, test_size=0.2, label_map=None):
+        parameters = {
+            'version': FORMAT_VERSION,
+            'source': source_hash,
+            'sample_size': sample_size,
+            'seed': seed,
+            'test_size': test_size,
+            'label_map': sorted(label_map.items()) if label_map else None,
+        }
+        return hashlib.sha256(json.dumps(parameters, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def _load(self, key):
+        directory = os.path.join(self.root, key)
+        return DatasetSplit(key, load_feature_store(os.path.join(directory, 'train.lrfs')), load_feature_store(os.path.join(directory, 'test.lrfs')))
+
+    def _remember(self, split):
+        self._cache[split.key] = split
+        self._cache.move_to_end(split.key)
+        if len(self._cache) > self.cache_size:
+            _, evicted = self._cache.popitem(last=False)
+            evicted.close()  # Releases its memory maps and file descriptors
+        return split
+
+    def split(self, source, sample_size, seed=0, test_size=0.2, label_map=None, load=None):
+        """
+        Cached train/test split of a sample of the source data.
+
+        On a miss, the data is loaded, sampled and split with random.Random(seed), parsed once
+        and written to the cache; the same arguments give the same rows on every run.
+
+        :param source: Path of the data file, or the raw data itself (lines or a FeatureStore).
+        :param sample_size: Number of rows sampled, at most all of them.
+        :param seed: Seed of the sampling and the shuffle.
+        :param test_size: Fraction of the sample held out for validation.
+        :param label_map: Optional {label: new label} applied before storing, e.g. to merge
+                          classes; labels not in it are kept.
+        :param load: Function reading a path into lines or a FeatureStore, only called on a miss.
+        :return: DatasetSplit.
+        """
+        if isinstance(source, str):
+            source_hash = self.source_hash(source)
+        elif isinstance(source, FeatureStore):
+            source_hash = store_hash(source)
+        else:
+            source_hash = lines_hash(source)
+        key = self.key(source_hash, sample_size, seed, test_size, label_map)
+
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            return self._cache[key]
+        if os.path.isdir(os.path.join(self.root, key)):
+            with phase('dataset_cache', hit=True, sample_size=sample_size):
+                return self._remember(self._load(key))
+
+        with phase('dataset_cache', hit=False, sample_size=sample_size):
+            data = load(source) if isinstance(source, str) else source
+            rng = random.Random(seed)
+            indices = rng.sample(range(len(data)), min(sample_size, len(data)))
+            sample = data.take(indices) if isinstance(data, FeatureStore) else [data[i] for i in indices]
+            X, labels = preprocess_for_multiclass_classification(sample)
+            if label_map:
+                labels = [label_map.get(label, label) for label in labels]
+            order = list(range(len(labels)))
+            rng.shuffle(order)
+            split_idx = int(len(order) * (1 - test_size))
+            train_idx, test_idx = order[:split_idx], order[split_idx:]
+
+            # Written next to the entry and renamed, so a half-written entry is never loaded
+            directory = os.path.join(self.root, key)
+            temporary = directory + f'.{os.getpid()}.tmp'
+            os.makedirs(temporary, exist_ok=True)
+            write_feature_store(os.path.join(temporary, 'train.lrfs'), X.take(train_idx), [labels[i] for i in train_idx])
+            write_feature_store(os.path.join(temporary, 'test.lrfs'), X.take(test_idx), [labels[i] for i in test_idx])
+            with open(os.path.join(temporary, 'meta.json'), 'w', encoding='utf-8') as file:
+                json.dump({'source': source if isinstance(source, str) else None, 'source_hash': source_hash, 'sample_size': sample_size,
+                           'seed': seed, 'test_size': test_size, 'label_map': label_map, 'rows': len(labels)}, file, indent=4)
+            try:
+                os.rename(temporary, directory)
+            except OSError:
+                shutil.rmtree(temporary)  # Another process stored the same entry first
+        return self._remember(self._load(key))
+
+_caches = {}
+
+def get_dataset_cache(root='.dataset_cache'):
+    # One cache, and so one in-memory LRU, per directory and process
+    root = os.path.abspath(root)
+    if root not in _caches:
+        _caches[root] = DatasetCache(root)
+    return _caches[root]
@@ -0,0 +1,166 @@
+import argparse
+import json
+import os
+import random
+import re
+import xml.etree.ElementTree as ET
+from multiprocessing import Pool
+
+from ExtractionAndProcessing import process_abstract
+from parseWikiDump import doc_to_abstract, iter_abstracts, iter_abstracts_from_json
+from reservoirSampling import Reservoir, merge_reservoirs
+
+# <doc> start tag of the abstract dumps, used to align shards on document boundaries
+_doc_start = re.compile(rb'<doc[\s>]')
+_doc_end = b'</doc>'
+_read_size = 1 << 20
+
+def input_kind(path):
+    # 'xml' and 'ndjson' inputs can be split into byte ranges, anything else is read by one worker
+    if path.endswith('.xml'):
+        return 'xml'
+    if path.endswith('.ndjson') or path.endswith('.jsonl'):
+        return 'ndjson'
+    return 'stream'
+
+def plan_shards(path, shard_size):
+    # Byte ranges of roughly shard_size bytes covering the file; workers align them to records
+    if input_kind(path) == 'stream':
+        return [(0, None)]
+    size = os.path.getsize(path)
+    starts = list(range(0, size, shard_size)) or [0]
+    return [(start, min(start + shard_size, size)) for start in starts]
+
+def _iter_xml_shard(path, start, end):
+    # (offset, abstract) for every <doc> whose start tag begins in [start, end)
+    with open(path, 'rb') as file:
+        file.seek(start)
+        buffer, buffer_offset, pos, eof = b'', start, 0, False
+        while True:
+            match = _doc_start.search(buffer, pos)
+            close = buffer.find(_doc_end, match.end()) if match else -1
+            if match is None or close < 0:
+                if match is not None and buffer_offset + match.start() >= end:
+                    return
+                if eof:
+                    return
+                # Keep the unparsed tail and read on
+                keep = match.start() if match is not None else max(pos, len(buffer) - 5)
+                chunk = file.read(_read_size)
+                eof = not chunk
+                buffer_offset += keep
+                buffer, pos = buffer[keep:] + chunk, 0
+                continue
+            offset = buffer_offset + match.start()
+            if offset >= end:
+                return
+            yield offset, doc_to_abstract(ET.fromstring(buffer[match.start():close + len(_doc_end)]))['abstract']
+            pos = close + len(_doc_end)
+
+def _iter_ndjson_shard(path, start, end):
+    # (offset, abstract) for every line that starts in [start, end)
+    with open(path, 'rb') as file:
+        if start > 0:
+            file.seek(start - 1)
+            file.readline()  # Finish the line the previous shard owns
+        while True:
+            offset = file.tell()
+            if offset >= end:
+                return
+            line = file.readline()
+            if not line:
+                return
+            if line.strip():
+                yield offset, json.loads(line)['abstract']
+
+def _iter_stream(path):
+    # Whole-file fallback for JSON arrays and compressed dumps
+    if path.endswith('.json'):
+        records = iter_abstracts_from_json(path)
+    else:
+        records = iter_abstracts(path)
+    for position, record in enumerate(records):
+        yield position, record['abstract']
+
+def _process_shard(task):
+    # Parse, clean and extract one shard; returns (seen, sample) per segment length
+    language, path, start, end, segment_lengths, max_data_points, seed = task
+    kind = input_kind(path)
+    if kind == 'xml':
+        abstracts = _iter_xml_shard(path, start, end)
+    elif kind == 'ndjson':
+        abstracts = _iter_ndjson_shard(path, start, end)
+    else:
+        abstracts = _iter_stream(path)
+
+    rng = random.Random(None if seed is None else f"{seed}:{language}:{path}:{start}")
+    reservoirs = {length: Reservoir(max_data_points, rng) for length in segment_lengths}
+    for offset, abstract in abstracts:
+        for length, line in process_abstract(abstract, language, segment_lengths):
+            reservoirs[length].add((offset, line))
+    return {length: (reservoir.seen, reservoir.items) for length, reservoir in reservoirs.items()}
+
+def run_pipeline(inputs, output_file, max_data_points, segment_lengths=(50, 20, 10), workers=None, seed=None, shard_size=64 << 20):
+    """
+    Dump or abstracts file to feature file, with parsing, cleaning and extraction in a process pool.
+
+    Uncompressed XML dumps and NDJSON abstracts are cut into byte-range shards aligned on
+    <doc> elements or lines. Each shard keeps a reservoir sample per segment length and the
+    shard samples are merged per language and length, so the max_data_points quotas hold for
+    the whole input and the sample is the same as one pass over it would draw.
+
+    :param inputs: List of (language, path) pairs.
+    :param output_file: Feature file to write, in the "lang: f1, f2, ..." text format.
+    :param max_data_points: Maximum number of segments per language and segment length.
+    :param workers: Number of worker processes, defaults to the number of CPUs.
+    :param seed: Seed of the sampling; the same seed gives the same output for any worker count.
+    :param shard_size: Approximate shard size in bytes.
+    :return: Number of feature lines written.
+    """
+    tasks, positions = [], []
+    for position, (language, path) in enumerate(inputs):
+        for start, end in plan_shards(path, shard_size):
+            tasks.append((language, path, start, end, tuple(segment_lengths), max_data_points, seed))
+            positions.append(position)
+
+    with Pool(workers) as pool:
+        shard_results = pool.map(_process_shard, tasks, chunksize=1)
+
+    rng = random.Random(None if seed is None else f"{seed}:merge")
+    count = 0
+    with open(output_file, 'w', encoding='utf-8') as outfile:
+        # One quota per language, shared by all of its input files
+        for language in dict.fromkeys(language for language, _ in inputs):
+            samples = {length: [] for length in segment_lengths}
+            for task, position, result in zip(tasks, positions, shard_results):
+                if task[0] == language:
+                    for length in segment_lengths:
+                        seen, items = result[length]
+                        samples[length].append((seen, [(position, offset, line) for offset, line in items]))
+            merged = []
+            for length in segment_lengths:
+                merged.extend(merge_reservoirs(samples[length], max_data_points, rng))
+            # Write features in the order the abstracts appear in the inputs
+            for _, _, line in sorted(merged):
+                outfile.write(line)
+                count += 1
+    return count
+
+def parse_input(value):
+    language, separator, path = value.partition('=')
+    if not separator or not language or not path:
+        raise argparse.ArgumentTypeError(f"expected LANGUAGE=PATH, got '{value}'")
+    return language, path
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Parse, clean and extract features from dumps or abstracts files in parallel.")
+    parser.add_argument("output_file", help="Output file for extracted features")
+    parser.add_argument("max_data_points", type=int, help="Maximum number of data points per language and segment length")
+    parser.add_argument("inputs", nargs='+', type=parse_input, help="LANGUAGE=PATH pairs; PATH is an .xml dump, an .ndjson/.jsonl or .json abstracts file, or a .gz/.bz2 dump")
+    parser.add_argument("--workers", type=int, default=None, help="Number of worker processes, default is the number of CPUs")
+    parser.add_argument("--seed", type=int, default=None, help="Random seed for reproducible sampling")
+    parser.add_argument("--shard-size", type=int, default=64, help="Shard size in MB")
+    args = parser.parse_args()
+
+    count = run_pipeline(args.inputs, args.output_file, args.max_data_points, workers=args.workers, seed=args.seed, shard_size=args.shard_size << 20)
+    print(f"Wrote {count} feature lines to '{args.output_file}'")
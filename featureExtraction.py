@@ -2,6 +2,9 @@
 
 import argparse
 import string
+
+from featureMatrix import FeatureMatrix
+from fusedFeatures import extract_features
 vowels = "aeiouAEIOU\u00E0\u00E8\u00E9\u00EC\u00ED\u00F2\u00F3\u00F9\u00FA\u00C0\u00C8\u00C9\u00CC\u00CD\u00D2\u00D3\u00D9\u00DA"
 
 def calculate_vowel_consonant_ratio(text):
@@ -63,10 +66,35 @@ def max_and_average_consonant_chain_lengths(text):
 
     return normalized_max_chain_length, average_chain_length
 
-def extract(data_file):
+remove_punct_trans = str.maketrans('', '', string.punctuation)
+
+def line_features(line):
+    # Feature row of one raw input line; a missing vcratio becomes NaN
+    vcratio, wvc, mwl, awl, mccl, accl = extract_features(line.translate(remove_punct_trans).strip())
+    return (float('nan') if vcratio is None else vcratio, wvc, mwl, awl, mccl, accl)
+
+def iter_feature_chunks(lines, chunk_size=4096):
+    """
+    Streams raw text lines through feature extraction, one FeatureMatrix per chunk.
+
+    Nothing is written to disk, so the rows can go straight into batch scoring and
+    several predictions can run in the same directory.
+
+    :param lines: Iterable of raw text lines, e.g. an open file.
+    :param chunk_size: Number of lines per chunk.
+    :return: Iterator of FeatureMatrix chunks with one row per input line.
+    """
+    X = FeatureMatrix()
+    for line in lines:
+        X.append_row(line_features(line))
+        if len(X) == chunk_size:
+            yield X
+            X = FeatureMatrix()
+    if len(X):
+        yield X
+
+def extract(data_file, output_file="input_feature.txt"):
     input_file = data_file
-    output_file = "input_feature.txt"
-    remove_punct_trans = str.maketrans('', '', string.punctuation)
 
     try:
         with open(input_file, "r", encoding="utf-8") as infile, open(output_file, "w", encoding="utf-8") as outfile:
@@ -74,15 +102,18 @@ def extract(data_file):
                 line = line.translate(remove_punct_trans)
                 line = line.strip()
 
-                # Call your feature extraction functions here
-                vcratio = calculate_vowel_consonant_ratio(line)
-                wvc = count_words_ending_with_vowels_normalized(line)
-                mwl, awl = max_and_average_word_length(line)
-                mccl, accl = max_and_average_consonant_chain_lengths(line)
+                # All six features in one pass, identical to the functions above
+                vcratio, wvc, mwl, awl, mccl, accl = extract_features(line)
 
                 outfile.write(f"{vcratio}, {wvc}, {mwl}, {awl}, {mccl}, {accl}\n")
     except FileNotFoundError:
         print(f"The corresponding language input file {input_file} does not exist.")
         return
 
-extract("langtest.txt")
\ No newline at end of file
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Extract segment features from a text file.")
+    parser.add_argument("data_file", nargs='?', default="langtest.txt", help="Input text file, one segment per line")
+    parser.add_argument("--output", default="input_feature.txt", help="Output feature file")
+    args = parser.parse_args()
+
+    extract(args.data_file, args.output)
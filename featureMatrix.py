@@ -0,0 +1,216 @@
+from array import array
+from bisect import bisect_left
+from itertools import repeat
+
+class FeatureMatrix:
+    """
+    Column-major feature matrix shared by training and prediction.
+
+    Each feature is stored as one contiguous float64 column (an array('d') or any
+    buffer of doubles), so models can walk a single feature without touching the others
+    and subsets are described by row indices instead of copied rows.
+    Indexing with an integer still returns that row as a list, so code written for
+    list-of-lists input (X[i][feature_index]) keeps working.
+    """
+    def __init__(self, columns=None, n_rows=None):
+        self.columns = [column if isinstance(column, (array, memoryview)) else array('d', column) for column in (columns or [])]
+        if n_rows is None:
+            n_rows = len(self.columns[0]) if self.columns else 0
+        self.n_rows = n_rows
+
+    @property
+    def n_features(self):
+        return len(self.columns)
+
+    @classmethod
+    def from_rows(cls, rows):
+        matrix = cls()
+        for row in rows:
+            matrix.append_row(row)
+        return matrix
+
+    def append_row(self, row):
+        if not self.columns and self.n_rows == 0:
+            self.columns = [array('d') for _ in range(len(row))]
+        for column, value in zip(self.columns, row):
+            column.append(value)
+        self.n_rows += 1
+
+    def column(self, feature_index):
+        return self.columns[feature_index]
+
+    def row(self, i):
+        return [column[i] for column in self.columns]
+
+    def take(self, indices):
+        # New matrix holding only the given rows, in the given order
+        return FeatureMatrix([array('d', [column[i] for i in indices]) for column in self.columns], n_rows=len(indices))
+
+    def tolist(self):
+        return [self.row(i) for i in range(self.n_rows)]
+
+    def __len__(self):
+        return self.n_rows
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return self.take(range(*i.indices(self.n_rows)))
+        if i < 0:
+            i += self.n_rows
+        if not 0 <= i < self.n_rows:
+            raise IndexError("FeatureMatrix row index out of range")
+        return self.row(i)
+
+    def __iter__(self):
+        for i in range(self.n_rows):
+            yield self.row(i)
+
+
+class SparseRow(dict):
+    # One row of a SparseFeatureMatrix: {feature_index: value}, 0.0 for every other feature
+    def __missing__(self, feature_index):
+        return 0.0
+
+class SparseFeatureMatrix:
+    """
+    Column-major (CSC) sparse feature matrix, e.g. for hashed n-gram counts.
+
+    The non-zero entries of feature f are rows indices[indptr[f]:indptr[f + 1]] with values
+    data[indptr[f]:indptr[f + 1]], in increasing row order; every other entry is 0. Split
+    searches walk only these entries. column(f) and X[i] give the dense column and a row
+    mapping with default 0.0, so the prediction code written for FeatureMatrix works as is.
+    """
+    def __init__(self, indptr, indices, data, n_rows, n_features):
+        self.indptr = indptr
+        self.indices = indices
+        self.data = data
+        self.n_rows = n_rows
+        self.n_features = n_features
+        self._nonzero_features = None
+
+    @classmethod
+    def from_rows(cls, rows, n_features):
+        """
+        Builds the matrix from sparse rows.
+
+        :param rows: Iterable of {feature_index: value} dicts, one per row.
+        :param n_features: Number of features (columns).
+        """
+        row_ids, col_ids, values = array('i'), array('i'), array('d')
+        n_rows = 0
+        for row in rows:
+            if 0 in row.values():
+                row = {feature_index: value for feature_index, value in row.items() if value != 0}
+            row_ids.extend(repeat(n_rows, len(row)))
+            col_ids.extend(row.keys())
+            values.extend(row.values())
+            n_rows += 1
+        return cls._from_coordinates(row_ids, col_ids, values, n_rows, n_features)
+
+    @classmethod
+    def _from_coordinates(cls, row_ids, col_ids, values, n_rows, n_features):
+        # Counting sort of (row, column, value) entries by column; rows keep their order
+        indptr = array('q', bytes(8 * (n_features + 1)))
+        for feature_index in col_ids:
+            indptr[feature_index + 1] += 1
+        for f in range(n_features):
+            indptr[f + 1] += indptr[f]
+        fill = array('q', indptr[:-1])
+        indices = array('i', bytes(4 * len(values)))
+        data = array('d', bytes(8 * len(values)))
+        for i, feature_index, value in zip(row_ids, col_ids, values):
+            pos = fill[feature_index]
+            indices[pos] = i
+            data[pos] = value
+            fill[feature_index] = pos + 1
+        return cls(indptr, indices, data, n_rows, n_features)
+
+    @property
+    def nnz(self):
+        return len(self.data)
+
+    def column_entries(self, feature_index):
+        # (rows, values) of the non-zero entries of one feature
+        start, end = self.indptr[feature_index], self.indptr[feature_index + 1]
+        return self.indices[start:end], self.data[start:end]
+
+    def nonzero_features(self):
+        # Features with at least one non-zero entry, in increasing order
+        if self._nonzero_features is None:
+            indptr = self.indptr
+            self._nonzero_features = [f for f in range(self.n_features) if indptr[f + 1] > indptr[f]]
+        return self._nonzero_features
+
+    def column(self, feature_index):
+        column = array('d', bytes(8 * self.n_rows))
+        for i, value in zip(*self.column_entries(feature_index)):
+            column[i] = value
+        return column
+
+    def row(self, i):
+        # Looks the row up in every column; use column() or the split searches for bulk access
+        row = SparseRow()
+        for f in self.nonzero_features():
+            start, end = self.indptr[f], self.indptr[f + 1]
+            pos = bisect_left(self.indices, i, start, end)
+            if pos < end and self.indices[pos] == i:
+                row[f] = self.data[pos]
+        return row
+
+    def take(self, indices):
+        # New matrix holding only the given rows, in the given order
+        positions = {}
+        for new_i, i in enumerate(indices):
+            positions.setdefault(i, []).append(new_i)
+        row_ids, col_ids, values = array('i'), array('i'), array('d')
+        for f in self.nonzero_features():
+            entries = sorted((new_i, value) for i, value in zip(*self.column_entries(f)) for new_i in positions.get(i, ()))
+            for new_i, value in entries:
+                row_ids.append(new_i)
+                col_ids.append(f)
+                values.append(value)
+        return SparseFeatureMatrix._from_coordinates(row_ids, col_ids, values, len(indices), self.n_features)
+
+    def __len__(self):
+        return self.n_rows
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return self.take(range(*i.indices(self.n_rows)))
+        if i < 0:
+            i += self.n_rows
+        if not 0 <= i < self.n_rows:
+            raise IndexError("SparseFeatureMatrix row index out of range")
+        return self.row(i)
+
+    def __iter__(self):
+        # All rows from one pass over the entries
+        rows = [SparseRow() for _ in range(self.n_rows)]
+        for f in self.nonzero_features():
+            for i, value in zip(*self.column_entries(f)):
+                rows[i][f] = value
+        return iter(rows)
+
+
+def as_feature_matrix(X):
+    """
+    Returns X as a FeatureMatrix, converting a list of rows if needed.
+
+    :param X: FeatureMatrix, SparseFeatureMatrix or list of feature rows.
+    :return: FeatureMatrix (or the SparseFeatureMatrix itself) with the same rows.
+    """
+    if isinstance(X, (FeatureMatrix, SparseFeatureMatrix)):
+        return X
+    return FeatureMatrix.from_rows(X)
+
+def encode_labels(y):
+    """
+    Encodes labels as a compact integer array.
+
+    :param y: Sequence of class labels.
+    :return: Tuple (codes, classes) where codes is an array('l') of indices into classes.
+             classes follows set(y) order, the order the original entropy() visits them.
+    """
+    classes = list(set(y))
+    class_codes = {label: code for code, label in enumerate(classes)}
+    return array('l', [class_codes[label] for label in y]), classes
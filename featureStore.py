@@ -0,0 +1,200 @@
+import argparse
+import json
+import mmap
+import random
+import struct
+import sys
+from array import array
+
+from featureMatrix import FeatureMatrix
+
+# File layout (little-endian):
+#   magic b'LRFS', version u16, float typecode ('d' or 'f') u8, pad u8, header length u32
+#   header: UTF-8 JSON with feature_names, labels (label vocabulary, null if unlabelled), n_rows
+#   zero padding to a multiple of 8 bytes
+#   one column of n_rows floats per feature, each padded to a multiple of 8 bytes
+#   n_rows int32 label codes indexing into the vocabulary, when labelled
+MAGIC = b'LRFS'
+VERSION = 1
+_prefix = struct.Struct('<4sHBxI')
+DEFAULT_FEATURE_NAMES = ['vcratio', 'wvc', 'mwl', 'awl', 'mccl', 'accl']
+
+def _padded(n_bytes):
+    return (n_bytes + 7) // 8 * 8
+
+class FeatureStore:
+    """
+    Feature matrix with optional class labels, as stored in a binary feature file.
+
+    X is a FeatureMatrix; label_codes holds one index into labels per row (None when the
+    file has no labels). Stores returned by load_feature_store are views on a memory map.
+    """
+    def __init__(self, X, label_codes=None, labels=None, feature_names=None, _mmap=None):
+        self.X = X
+        self.label_codes = label_codes
+        self.labels = labels
+        self.feature_names = feature_names or DEFAULT_FEATURE_NAMES[:X.n_features]
+        self._mmap = _mmap
+
+    def __len__(self):
+        return len(self.X)
+
+    def label_list(self):
+        # Class label of every row
+        return [self.labels[code] for code in self.label_codes]
+
+    def take(self, indices):
+        label_codes = None if self.label_codes is None else array('i', [self.label_codes[i] for i in indices])
+        return FeatureStore(self.X.take(indices), label_codes, self.labels, self.feature_names)
+
+    def sample(self, sample_size, rng=random):
+        # Random rows, like loadData.sample_data does for text lines
+        return self.take(rng.sample(range(len(self)), min(sample_size, len(self))))
+
+    def close(self):
+        self.X = self.label_codes = None
+        if self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError:
+                pass  # Columns are still used elsewhere; the map is released with them
+            self._mmap = None
+
+def write_feature_store(path, X, labels=None, feature_names=None, typecode='d'):
+    """
+    Writes a feature matrix and its labels to a binary feature file.
+
+    :param X: FeatureMatrix or list of feature rows.
+    :param labels: Class label per row, or None for unlabelled features.
+    :param feature_names: Column names, default is the six segment features.
+    :param typecode: 'd' for float64 or 'f' for float32 columns.
+    """
+    X = X if isinstance(X, FeatureMatrix) else FeatureMatrix.from_rows(X)
+    vocabulary = None
+    if labels is not None:
+        vocabulary = sorted(set(labels))
+        codes = {label: code for code, label in enumerate(vocabulary)}
+        label_codes = array('i', [codes[label] for label in labels])
+    header = json.dumps({
+        'feature_names': feature_names or DEFAULT_FEATURE_NAMES[:X.n_features],
+        'labels': vocabulary,
+        'n_rows': len(X),
+    }).encode('utf-8')
+
+    with open(path, 'wb') as file:
+        start = _prefix.size + len(header)
+        file.write(_prefix.pack(MAGIC, VERSION, ord(typecode), len(header)) + header + b'\0' * (_padded(start) - start))
+        for column in X.columns:
+            data = array(typecode, column)
+            if sys.byteorder != 'little':
+                data.byteswap()
+            data = data.tobytes()
+            file.write(data + b'\0' * (_padded(len(data)) - len(data)))
+        if vocabulary is not None:
+            if sys.byteorder != 'little':
+                label_codes.byteswap()
+            file.write(label_codes.tobytes())
+
+def is_feature_store(path):
+    with open(path, 'rb') as file:
+        return file.read(len(MAGIC)) == MAGIC
+
+def load_feature_store(path):
+    """
+    Memory-maps a binary feature file without copying or parsing the data.
+
+    :param path: File written by write_feature_store.
+    :return: FeatureStore whose columns and label codes are views on the mapped file.
+    """
+    with open(path, 'rb') as file:
+        mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    magic, version, typecode, header_length = _prefix.unpack_from(mapped, 0)
+    if magic != MAGIC:
+        raise ValueError(f"{path} is not a binary feature file")
+    if version != VERSION:
+        raise ValueError(f"Unsupported feature file version {version} in {path}")
+    typecode = chr(typecode)
+    header = json.loads(mapped[_prefix.size:_prefix.size + header_length].decode('utf-8'))
+    n_rows = header['n_rows']
+
+    view = memoryview(mapped)
+    offset = _padded(_prefix.size + header_length)
+    column_bytes = n_rows * array(typecode).itemsize
+    columns = []
+    for _ in header['feature_names']:
+        column = view[offset:offset + column_bytes].cast(typecode)
+        if sys.byteorder != 'little':
+            column = array(typecode, column)
+            column.byteswap()
+        columns.append(column)
+        offset += _padded(column_bytes)
+
+    label_codes = None
+    if header['labels'] is not None:
+        label_codes = view[offset:offset + 4 * n_rows].cast('i')
+        if sys.byteorder != 'little':
+            label_codes = array('i', label_codes)
+            label_codes.byteswap()
+    return FeatureStore(FeatureMatrix(columns, n_rows=n_rows), label_codes, header['labels'], header['feature_names'], _mmap=mapped)
+
+def _parse_value(value):
+    # "None" is what the text writers print for a segment without letters
+    value = value.strip()
+    return float('nan') if value == 'None' else float(value)
+
+def read_text_features(lines):
+    """
+    Parses text feature lines, "lang: f1, f2, ..." or unlabelled "f1, f2, ...".
+
+    :param lines: Iterable of lines; blank lines are skipped.
+    :return: Tuple (X, labels) where labels is None for unlabelled lines.
+    """
+    X = FeatureMatrix()
+    labels = []
+    for line in lines:
+        if not line.strip():
+            continue
+        label, separator, features_str = line.rpartition(':')
+        X.append_row([_parse_value(feature) for feature in features_str.split(',') if feature.strip()])
+        labels.append(label.strip() if separator else None)
+    if labels and labels[0] is None:
+        labels = None
+    return X, labels
+
+def text_to_store(text_path, store_path, typecode='d'):
+    with open(text_path, 'r', encoding='utf-8') as infile:
+        X, labels = read_text_features(infile)
+    write_feature_store(store_path, X, labels, typecode=typecode)
+    return len(X)
+
+def store_to_text(store_path, text_path):
+    store = load_feature_store(store_path)
+    labels = store.label_list() if store.label_codes is not None else None
+    with open(text_path, 'w', encoding='utf-8') as outfile:
+        for i, row in enumerate(store.X):
+            features = ', '.join(str(value) for value in row)
+            outfile.write(f"{labels[i]}: {features}\n" if labels is not None else f"{features}\n")
+    count = len(store)
+    store.close()
+    return count
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert feature files between the text and binary formats.")
+    subparsers = parser.add_subparsers(dest='command')
+    to_binary = subparsers.add_parser('to-binary', help="Text feature lines to a binary feature file")
+    to_binary.add_argument('text_file')
+    to_binary.add_argument('store_file')
+    to_binary.add_argument('--float32', action='store_true', help="Store float32 instead of float64 columns")
+    to_text = subparsers.add_parser('to-text', help="Binary feature file to text feature lines")
+    to_text.add_argument('store_file')
+    to_text.add_argument('text_file')
+    args = parser.parse_args()
+
+    if args.command == 'to-binary':
+        count = text_to_store(args.text_file, args.store_file, typecode='f' if args.float32 else 'd')
+        print(f"Wrote {count} rows to '{args.store_file}'")
+    elif args.command == 'to-text':
+        count = store_to_text(args.store_file, args.text_file)
+        print(f"Wrote {count} rows to '{args.text_file}'")
+    else:
+        parser.print_help()
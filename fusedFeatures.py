@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+
+import re
+
+from featureMatrix import FeatureMatrix
+
+vowels = "aeiouAEIOU\u00E0\u00E8\u00E9\u00EC\u00ED\u00F2\u00F3\u00F9\u00FA\u00C0\u00C8\u00C9\u00CC\u00CD\u00D2\u00D3\u00D9\u00DA"
+consonants = 'bcdfghjklmnpqrstvwxyzBCDFGHJKLMNPQRSTVWXYZ'
+
+# Character classes, one letter each so a segment can be rewritten as a class string:
+# 'v' vowel, 'c' ASCII consonant, 'a' any other letter, ' ' whitespace, 'o' anything else
+class _CharClassTable(dict):
+    def __missing__(self, code_point):
+        char = chr(code_point)
+        if char in vowels:
+            char_class = 'v'
+        elif char in consonants:
+            char_class = 'c'
+        elif char.isalpha():
+            char_class = 'a'
+        elif char.isspace():  # Same whitespace definition str.split() uses
+            char_class = ' '
+        else:
+            char_class = 'o'
+        self[code_point] = char_class
+        return char_class
+
+char_classes = _CharClassTable()
+for _code_point in range(0x250):  # Precompute Latin scripts; anything else is filled in on first use
+    char_classes[_code_point]
+
+_consonant_run = re.compile('c+')
+
+def extract_features(text):
+    """
+    Computes all six segment features in one pass over the characters.
+
+    The segment is translated once through the character-class table; every count is then
+    taken on that class string with C-level string methods instead of re-splitting and
+    re-scanning the text per feature. The results are bit-identical (values and int/float
+    types) to calculate_vowel_consonant_ratio, count_words_ending_with_vowels_normalized,
+    max_and_average_word_length and max_and_average_consonant_chain_lengths.
+
+    :param text: Cleaned text segment.
+    :return: Tuple (vcratio, wvc, mwl, awl, mccl, accl); vcratio is None when the segment has no letters.
+    """
+    classes = text.translate(char_classes)
+
+    vowel_count = classes.count('v')
+    consonant_chars = classes.count('c')
+    consonant_count = consonant_chars + classes.count('a')
+    if consonant_count == 0:
+        vcratio = None if vowel_count == 0 else float('inf')
+    else:
+        vcratio = vowel_count / consonant_count
+
+    words = classes.split()
+    word_count = len(words)
+    if word_count > 0:
+        # A word ends in a vowel when a 'v' is followed by whitespace or the end of the text
+        wvc = (classes + ' ').count('v ') / word_count
+        mwl = max(map(len, words))
+        awl = (len(classes) - classes.count(' ')) / word_count
+    else:
+        wvc, mwl, awl = 0, 0, 0
+
+    total_chars = len(text)
+    if total_chars > 0:
+        max_chain_length = max(map(len, _consonant_run.findall(classes)), default=0)
+        mccl = max_chain_length / total_chars
+        accl = consonant_chars / total_chars
+    else:
+        mccl, accl = 0, 0
+
+    return vcratio, wvc, mwl, awl, mccl, accl
+
+def extract_feature_matrix(segments):
+    """
+    Extracts the features of many segments into a FeatureMatrix.
+
+    :param segments: Iterable of cleaned text segments.
+    :return: FeatureMatrix with one row per segment; a missing vcratio is stored as NaN.
+    """
+    X = FeatureMatrix()
+    for segment in segments:
+        vcratio, wvc, mwl, awl, mccl, accl = extract_features(segment)
+        X.append_row((float('nan') if vcratio is None else vcratio, wvc, mwl, awl, mccl, accl))
+    return X
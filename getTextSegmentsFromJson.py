@@ -1,54 +1,44 @@
-import json
 import random
 import argparse
 
-def extract_segments(input_json, output_10, output_20, output_50):
-    # Read the JSON file containing abstracts
-    with open(input_json, 'r', encoding='utf-8') as json_file:
-        data = json.load(json_file)
-        abstracts = [item['abstract'] for item in data]
+from parseWikiDump import iter_abstracts_from_json
+from reservoirSampling import Reservoir
 
-    # Shuffle the list of abstracts
-    random.shuffle(abstracts)
+def extract_segments(input_json, output_10, output_20, output_50, max_segments=5000, seed=None):
+    # Stream the abstracts (JSON or NDJSON) and keep a seeded uniform sample per segment length
+    rng = random.Random(seed)
 
-    # Initialize counters for each segment length
-    segments_10 = []
-    segments_20 = []
-    segments_50 = []
+    # Initialize a reservoir for each segment length
+    segments_10 = Reservoir(max_segments, rng)
+    segments_20 = Reservoir(max_segments, rng)
+    segments_50 = Reservoir(max_segments, rng)
 
     # Extract segments based on word count criteria
-    for abstract in abstracts:
-        words = abstract.split()
+    for position, item in enumerate(iter_abstracts_from_json(input_json)):
+        words = item['abstract'].split()
         if len(words) >= 50:
             segment = ' '.join(words[:50])
-            segments_50.append(segment)
+            segments_50.add((position, segment))
         elif len(words) >= 20:
             segment = ' '.join(words[:20])
-            segments_20.append(segment)
+            segments_20.add((position, segment))
         elif len(words) >= 10:
             segment = ' '.join(words[:10])
-            segments_10.append(segment)
+            segments_10.add((position, segment))
 
-        # Check if we have reached 5000 segments for each length
-        if len(segments_10) == 5000 and len(segments_20) == 5000 and len(segments_50) == 5000:
-            break
-
-    # Save segments to separate text files
-    with open(output_10, 'w', encoding='utf-8') as file:
-        file.write('\n'.join(segments_10))
-
-    with open(output_20, 'w', encoding='utf-8') as file:
-        file.write('\n'.join(segments_20))
-
-    with open(output_50, 'w', encoding='utf-8') as file:
-        file.write('\n'.join(segments_50))
+    # Save segments to separate text files, in input order
+    for reservoir, output_file in ((segments_10, output_10), (segments_20, output_20), (segments_50, output_50)):
+        with open(output_file, 'w', encoding='utf-8') as file:
+            file.write('\n'.join(segment for _, segment in sorted(reservoir.items)))
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Extract text segments from JSON file.")
-    parser.add_argument("input_json", help="Input JSON file containing abstracts")
+    parser.add_argument("input_json", help="Input JSON or NDJSON file containing abstracts")
     parser.add_argument("output_10", help="Output file for 10-word segments")
     parser.add_argument("output_20", help="Output file for 20-word segments")
     parser.add_argument("output_50", help="Output file for 50-word segments")
+    parser.add_argument("--max-segments", type=int, default=5000, help="Maximum number of segments per length")
+    parser.add_argument("--seed", type=int, default=None, help="Random seed for reproducible sampling")
     args = parser.parse_args()
 
-    extract_segments(args.input_json, args.output_10, args.output_20, args.output_50)
+    extract_segments(args.input_json, args.output_10, args.output_20, args.output_50, max_segments=args.max_segments, seed=args.seed)
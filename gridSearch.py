@@ -0,0 +1,181 @@
+import multiprocessing
+import os
+from array import array
+from multiprocessing.shared_memory import SharedMemory
+
+from featureMatrix import FeatureMatrix, as_feature_matrix, encode_labels
+from DecisionTree import build_tree, depth_accuracies, truncate_tree
+from AdaBoostWithStumps import tune_number_of_learners_multiclass
+from instrumentation import phase
+
+# Dataset attached by each worker process, see _attach_dataset
+_shared = None
+
+def share_dataset(X_train, y_train, X_val, y_val):
+    """
+    Copies a train/validation split into one shared memory block.
+
+    Feature columns are stored as float64 and labels as int64 codes, so worker processes
+    can map the data instead of receiving a pickled copy with every task.
+
+    :return: Tuple (shm, spec) where spec is the small description workers attach with.
+             The caller owns shm and must close and unlink it.
+    """
+    X_train, X_val = as_feature_matrix(X_train), as_feature_matrix(X_val)
+    codes, classes = encode_labels(list(y_train) + list(y_val))
+    n_features = X_train.n_features
+    size = 8 * ((len(X_train) + len(X_val)) * n_features + len(codes))
+    shm = SharedMemory(create=True, size=max(size, 8))
+
+    offset = 0
+    for matrix in (X_train, X_val):
+        for column in matrix.columns:
+            data = array('d', column).tobytes()
+            shm.buf[offset:offset + len(data)] = data
+            offset += len(data)
+    data = array('q', codes).tobytes()
+    shm.buf[offset:offset + len(data)] = data
+
+    spec = {'name': shm.name, 'n_features': n_features, 'n_train': len(X_train), 'n_val': len(X_val), 'classes': classes}
+    return shm, spec
+
+def _attach_dataset(spec):
+    # Worker initializer: map the shared block as FeatureMatrix columns and decode the labels
+    global _shared
+    shm = SharedMemory(name=spec['name'])
+    n_features, n_train, n_val = spec['n_features'], spec['n_train'], spec['n_val']
+    n_values = (n_train + n_val) * n_features
+    values = shm.buf[:8 * n_values].cast('d')
+    codes = shm.buf[8 * n_values:8 * (n_values + n_train + n_val)].cast('q')
+
+    train_columns = [values[k * n_train:(k + 1) * n_train] for k in range(n_features)]
+    val_start = n_train * n_features
+    val_columns = [values[val_start + k * n_val:val_start + (k + 1) * n_val] for k in range(n_features)]
+    classes = spec['classes']
+    labels = [classes[code] for code in codes]
+    _shared = (shm, FeatureMatrix(train_columns, n_rows=n_train), labels[:n_train], FeatureMatrix(val_columns, n_rows=n_val), labels[n_train:])
+
+def _tree_task(params):
+    # Grow once to the deepest requested depth and score every depth cut-off
+    max_depth_values, min_samples_split = params
+    _, X_train, y_train, X_val, y_val = _shared
+    deepest = None if None in max_depth_values else max(max_depth_values)
+    with phase('grid_point', min_samples_split=min_samples_split):
+        tree = build_tree(X_train, y_train, max_depth=deepest, min_samples_split=min_samples_split)
+        with phase('validation', rows=len(y_val)):
+            accuracies = depth_accuracies(tree, X_val, y_val, max_depth_values)
+    return accuracies, tree
+
+def _boosting_task(params):
+    classes, learner_values = params
+    _, X_train, labels_train, X_val, labels_val = _shared
+    with phase('grid_point', classes=list(classes)):
+        return tune_number_of_learners_multiclass(X_train, labels_train, X_val, labels_val, classes, learner_values)
+
+def _call(call):
+    task, params = call
+    return task(params)
+
+def _run_calls(X_train, y_train, X_val, y_val, calls, workers):
+    # Run (task, params) pairs in one process pool attached to the shared dataset; results keep
+    # the order of calls
+    global _shared
+    workers = min(workers or os.cpu_count() or 1, len(calls))
+    if workers <= 1:
+        _shared = (None, as_feature_matrix(X_train), list(y_train), as_feature_matrix(X_val), list(y_val))
+        try:
+            return [task(params) for task, params in calls]
+        finally:
+            _shared = None
+
+    shm, spec = share_dataset(X_train, y_train, X_val, y_val)
+    try:
+        # fork keeps the parent's hash seed, so set() orders and tie-breaks match a serial run
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context('fork' if 'fork' in methods else None)
+        with context.Pool(workers, initializer=_attach_dataset, initargs=(spec,)) as pool:
+            return pool.map(_call, calls, chunksize=1)
+    finally:
+        shm.close()
+        shm.unlink()
+
+def _run(X_train, y_train, X_val, y_val, task, params, workers):
+    # Run task over params in a process pool attached to the shared dataset; results keep params order
+    return _run_calls(X_train, y_train, X_val, y_val, [(task, p) for p in params], workers)
+
+def _tree_tasks(max_depth_values, min_samples_split_values):
+    # One task per min_samples_split; each grows a single tree shared by all max depths
+    return [(list(max_depth_values), min_samples_split) for min_samples_split in min_samples_split_values]
+
+def _best_tree(tree_results, max_depth_values, min_samples_split_values):
+    results = dict(zip(min_samples_split_values, tree_results))
+    best_max_depth = None
+    best_min_samples_split = None
+    best_accuracy = float('-inf')
+    best_tree = None
+    for max_depth in max_depth_values:
+        for min_samples_split in min_samples_split_values:
+            accuracies, tree = results[min_samples_split]
+            if accuracies[max_depth] > best_accuracy:
+                best_max_depth = max_depth
+                best_min_samples_split = min_samples_split
+                best_accuracy = accuracies[max_depth]
+                best_tree = truncate_tree(tree, max_depth)
+
+    return best_max_depth, best_min_samples_split, best_accuracy, best_tree
+
+def _class_results(groups, group_results, classes):
+    results = {}
+    for (group_classes, _), group_result in zip(groups, group_results):
+        results.update(zip(group_classes, group_result))
+    return [results[cls] for cls in classes]
+
+def parallel_hyperparameter_tuning(X_train, y_train, X_val, y_val, max_depth_values, min_samples_split_values, workers=None):
+    """
+    DecisionTree.hyperparameter_tuning with the min_samples_split values spread over a process pool.
+
+    :param workers: Number of worker processes, defaults to the number of CPUs.
+    :return: Same as hyperparameter_tuning; the result does not depend on the worker count.
+    """
+    tasks = _tree_tasks(max_depth_values, min_samples_split_values)
+    tree_results = _run(X_train, y_train, X_val, y_val, _tree_task, tasks, workers)
+    return _best_tree(tree_results, max_depth_values, min_samples_split_values)
+
+def parallel_tune_number_of_learners_multiclass(X_train, labels_train, X_val, labels_val, classes, learner_values, workers=None):
+    """
+    tune_number_of_learners_multiclass with the classes split over a process pool.
+
+    Each worker trains its share of the classes in one shared sweep. The per-class models
+    are the same whichever way the classes are grouped.
+
+    :param workers: Number of worker processes, defaults to the number of CPUs.
+    :return: Same as tune_number_of_learners_multiclass.
+    """
+    classes = list(classes)
+    n_groups = min(workers or os.cpu_count() or 1, len(classes))
+    groups = [(classes[k::n_groups], learner_values) for k in range(n_groups)]
+    group_results = _run(X_train, labels_train, X_val, labels_val, _boosting_task, groups, workers)
+    return _class_results(groups, group_results, classes)
+
+def parallel_tuning(X_train, labels_train, X_val, labels_val, max_depth_values, min_samples_split_values, classes,
+                    learner_values, workers=None):
+    """
+    parallel_hyperparameter_tuning and parallel_tune_number_of_learners_multiclass on one split,
+    in one process pool over one shared memory block.
+
+    Every min_samples_split value and every class is its own task, so the tree and boosting
+    grids run side by side instead of one pool after the other.
+
+    :param workers: Number of worker processes, defaults to the number of CPUs.
+    :return: Tuple (tree result as parallel_hyperparameter_tuning returns it, boosting results
+             as parallel_tune_number_of_learners_multiclass returns them).
+    """
+    classes = list(classes)
+    groups = [([cls], learner_values) for cls in classes]
+    tree_tasks = _tree_tasks(max_depth_values, min_samples_split_values)
+    # Boosting tasks first: they run longest, so they should not wait behind the trees
+    calls = [(_boosting_task, group) for group in groups] + [(_tree_task, task) for task in tree_tasks]
+    results = _run_calls(X_train, labels_train, X_val, labels_val, calls, workers)
+    group_results, tree_results = results[:len(groups)], results[len(groups):]
+    return (_best_tree(tree_results, max_depth_values, min_samples_split_values),
+            _class_results(groups, group_results, classes))
@@ -0,0 +1,120 @@
+import json
+import os
+import sys
+import threading
+import time
+
+# Opt-in profiling. Code marks its phases with
+#
+#     with phase('split_search', rows=n) as p:
+#         ...
+#         p.add(candidates=k)
+#
+# While profiling is off, phase() returns one shared do-nothing context, so the hooks cost a
+# function call per phase and nothing per row. Once enable() is called, every phase writes a
+# JSON line with its name, the path of the enclosing phases, wall time, fields and counters,
+# and rows_per_second when a rows field is given.
+
+class _NullPhase:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def add(self, **counts):
+        pass
+
+_null_phase = _NullPhase()
+
+class _Phase:
+    def __init__(self, profiler, name, fields):
+        self.profiler = profiler
+        self.name = name
+        self.fields = fields
+        self.counts = {}
+
+    def __enter__(self):
+        stack = self.profiler.stack()
+        self.path = '/'.join([phase.name for phase in stack] + [self.name])
+        stack.append(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        seconds = time.perf_counter() - self.start
+        self.profiler.stack().pop()
+        record = {'event': 'phase', 'name': self.name, 'path': self.path, 'seconds': seconds}
+        record.update(self.fields)
+        record.update(self.counts)
+        if 'rows' in self.fields and seconds > 0:
+            record['rows_per_second'] = self.fields['rows'] / seconds
+        self.profiler.write(record)
+        return False
+
+    def add(self, **counts):
+        # Accumulate counters (e.g. candidate thresholds evaluated) reported with the phase
+        for key, value in counts.items():
+            self.counts[key] = self.counts.get(key, 0) + value
+
+class Profiler:
+    """
+    Writes phase timings as JSON lines.
+
+    :param output: Open text file the records are written to; every record is one line,
+                   flushed at once so worker processes sharing the file do not interleave.
+    """
+    def __init__(self, output):
+        self.output = output
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def stack(self):
+        # Enclosing phases of the current thread
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
+
+    def write(self, record):
+        record['pid'] = os.getpid()
+        record['time'] = time.time()
+        line = json.dumps(record) + '\n'
+        with self._lock:
+            self.output.write(line)
+            self.output.flush()
+
+_profiler = None
+
+def enable(path=None):
+    """
+    Turns profiling on for this process and the worker processes it forks afterwards.
+
+    :param path: JSON-lines file to append to, or None for standard error.
+    :return: The active Profiler.
+    """
+    global _profiler
+    output = sys.stderr if path is None else open(path, 'a', encoding='utf-8')
+    _profiler = Profiler(output)
+    return _profiler
+
+def disable():
+    global _profiler
+    if _profiler is not None and _profiler.output is not sys.stderr:
+        _profiler.output.close()
+    _profiler = None
+
+def enabled():
+    return _profiler is not None
+
+def phase(name, **fields):
+    # Timing context for one phase; free when profiling is off
+    if _profiler is None:
+        return _null_phase
+    return _Phase(_profiler, name, fields)
+
+def event(name, **fields):
+    # One-off record, e.g. a selected hyperparameter or a dataset size
+    if _profiler is not None:
+        record = {'event': name}
+        record.update(fields)
+        _profiler.write(record)
@@ -0,0 +1,139 @@
+import json
+import mmap
+import struct
+import sys
+from array import array
+
+from DecisionTree import CompiledTree, compile_tree
+from AdaBoostWithStumps import AdaBoost, PackedStumps
+
+# File layout (little-endian):
+#   magic b'LRMD', version u16, reserved u16, header length u32
+#   header: UTF-8 JSON with kind, classes, metadata and, per model, the offset and length of
+#           each of its arrays
+#   zero padding to a multiple of 8 bytes
+#   the arrays, each starting on a multiple of 8 bytes
+# Trees store the CompiledTree arrays, boosting models the PackedStumps arrays; a multiclass
+# bundle holds one PackedStumps per class, in the order of classes.
+MAGIC = b'LRMD'
+VERSION = 1
+_prefix = struct.Struct('<4sHxxI')
+
+# Array name and fixed-size typecode per model kind
+_TREE_ARRAYS = (('feature_index', 'i'), ('threshold', 'd'), ('left', 'i'), ('right', 'i'), ('value', 'i'))
+_STUMP_ARRAYS = (('feature_index', 'i'), ('threshold', 'd'), ('polarity', 'b'), ('alpha', 'd'))
+
+def _padded(n_bytes):
+    return (n_bytes + 7) // 8 * 8
+
+class ModelFile:
+    """
+    Models loaded from a binary model file.
+
+    kind is 'tree' (models holds one CompiledTree) or 'stumps' (one PackedStumps per class,
+    in the order of classes). The arrays are views on a memory map of the file.
+    """
+    def __init__(self, kind, models, classes, metadata=None, _mmap=None):
+        self.kind = kind
+        self.models = models
+        self.classes = classes
+        self.metadata = metadata or {}
+        self._mmap = _mmap
+
+    def close(self):
+        self.models = None
+        if self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError:
+                pass  # Models are still used elsewhere; the map is released with them
+            self._mmap = None
+
+def write_model_file(path, models, classes=None, metadata=None):
+    """
+    Writes a decision tree or a set of one-vs-all AdaBoost models to a binary model file.
+
+    :param models: Root Node or CompiledTree, or a list of AdaBoost or PackedStumps models.
+    :param classes: Class of each boosting model; ignored for a tree, which stores its own labels.
+    :param metadata: JSON-serializable dict saved with the models, e.g. hyperparameters.
+    """
+    if isinstance(models, (list, tuple)):
+        kind = 'stumps'
+        packed = [model.pack() if isinstance(model, AdaBoost) else model for model in models]
+        if classes is None or len(classes) != len(packed):
+            raise ValueError("classes must name the class of every boosting model")
+        fields = _STUMP_ARRAYS
+    else:
+        kind = 'tree'
+        packed = [models if isinstance(models, CompiledTree) else compile_tree(models)]
+        classes = packed[0].classes
+        fields = _TREE_ARRAYS
+
+    # Lay the arrays out after the header, whose length depends on the offsets it lists
+    blobs, entries, offset = [], [], 0
+    for model in packed:
+        entry = {'length': len(model)}
+        for name, typecode in fields:
+            data = array(typecode, getattr(model, name))
+            if sys.byteorder != 'little':
+                data.byteswap()
+            data = data.tobytes()
+            entry[name] = offset
+            blobs.append(data + b'\0' * (_padded(len(data)) - len(data)))
+            offset += _padded(len(data))
+        entries.append(entry)
+    header = json.dumps({
+        'kind': kind,
+        'classes': list(classes),
+        'metadata': metadata or {},
+        'models': entries,
+    }).encode('utf-8')
+
+    with open(path, 'wb') as file:
+        start = _prefix.size + len(header)
+        file.write(_prefix.pack(MAGIC, VERSION, len(header)) + header + b'\0' * (_padded(start) - start))
+        for blob in blobs:
+            file.write(blob)
+
+def is_model_file(path):
+    with open(path, 'rb') as file:
+        return file.read(len(MAGIC)) == MAGIC
+
+def load_model_file(path):
+    """
+    Memory-maps a binary model file; nothing is unpickled or executed.
+
+    The header is parsed and every array becomes a view on the map, so loading takes the
+    same time for any tree depth or ensemble size.
+
+    :param path: File written by write_model_file.
+    :return: ModelFile.
+    """
+    with open(path, 'rb') as file:
+        mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    magic, version, header_length = _prefix.unpack_from(mapped, 0)
+    if magic != MAGIC:
+        raise ValueError(f"{path} is not a binary model file")
+    if version != VERSION:
+        raise ValueError(f"Unsupported model file version {version} in {path}")
+    header = json.loads(mapped[_prefix.size:_prefix.size + header_length].decode('utf-8'))
+    base = _padded(_prefix.size + header_length)
+
+    view = memoryview(mapped)
+    kind = header['kind']
+    fields = _TREE_ARRAYS if kind == 'tree' else _STUMP_ARRAYS
+    models = []
+    for entry in header['models']:
+        arrays = []
+        for name, typecode in fields:
+            start = base + entry[name]
+            data = view[start:start + entry['length'] * array(typecode).itemsize].cast(typecode)
+            if sys.byteorder != 'little':
+                data = array(typecode, data)
+                data.byteswap()
+            arrays.append(data)
+        if kind == 'tree':
+            models.append(CompiledTree(*arrays, header['classes']))
+        else:
+            models.append(PackedStumps(*arrays))
+    return ModelFile(kind, models, header['classes'], header['metadata'], _mmap=mapped)
@@ -0,0 +1,153 @@
+import hashlib
+import json
+import os
+import time
+from array import array
+from collections import OrderedDict
+
+from featureMatrix import as_feature_matrix
+from modelFormat import load_model_file, write_model_file
+
+MANIFEST = 'manifest.json'
+
+def dataset_hash(X, y):
+    # Content hash of a training set: every feature column as float64, then the labels
+    X = as_feature_matrix(X)
+    digest = hashlib.sha256()
+    for column in X.columns:
+        digest.update(array('d', column).tobytes())
+    digest.update(json.dumps([str(label) for label in y]).encode('utf-8'))
+    return digest.hexdigest()
+
+class ModelRegistry:
+    """
+    Directory of binary model files described by a manifest.json.
+
+    Every entry records the model ID, kind ('tree' or 'stumps'), classes, hyperparameters,
+    metrics and the hash of its training data. Names are resolved when a model is loaded:
+    'best' is the entry of that kind with the highest accuracy, 'latest' the newest one,
+    and anything else an alias set with set_alias or a model ID. Loaded models are kept
+    in an LRU cache, and the manifest is re-read whenever it changes on disk, so new models
+    are picked up without restarting the process.
+
+    :param root: Registry directory, created on the first register.
+    :param cache_size: Number of loaded models kept in memory.
+    """
+    def __init__(self, root='models', cache_size=4):
+        self.root = root
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._manifest = None
+        self._manifest_stamp = None
+
+    def manifest(self):
+        path = os.path.join(self.root, MANIFEST)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return {'models': [], 'aliases': {}}
+        stamp = (stat.st_mtime_ns, stat.st_size)
+        if stamp != self._manifest_stamp:
+            with open(path, 'r', encoding='utf-8') as file:
+                self._manifest = json.load(file)
+            self._manifest_stamp = stamp
+        return self._manifest
+
+    def _save_manifest(self, manifest):
+        # Write to a temporary file and rename, so readers never see a partial manifest
+        path = os.path.join(self.root, MANIFEST)
+        temporary = path + f'.{os.getpid()}.tmp'
+        with open(temporary, 'w', encoding='utf-8') as file:
+            json.dump(manifest, file, indent=4)
+        os.replace(temporary, path)
+
+    def register(self, models, classes=None, hyperparameters=None, metrics=None, data_hash=None):
+        """
+        Saves a model into the registry and adds it to the manifest.
+
+        :param models: Decision tree, or list of one-vs-all AdaBoost models (see write_model_file).
+        :param classes: Class of each boosting model.
+        :param hyperparameters: Dict of the selected hyperparameters.
+        :param metrics: Dict of validation metrics; 'accuracy' ranks the models for 'best'.
+        :param data_hash: Hash of the training data, e.g. from dataset_hash.
+        :return: ID of the new model.
+        """
+        os.makedirs(self.root, exist_ok=True)
+        temporary = os.path.join(self.root, f'.{os.getpid()}.lrm.tmp')
+        write_model_file(temporary, models, classes, metadata=hyperparameters)
+        with open(temporary, 'rb') as file:
+            content_hash = hashlib.sha256(file.read()).hexdigest()
+        model_file = load_model_file(temporary)
+        kind, classes = model_file.kind, model_file.classes
+        model_file.close()
+
+        model_id = f"{kind}-{time.strftime('%Y%m%d%H%M%S')}-{content_hash[:8]}"
+        filename = model_id + '.lrm'
+        os.replace(temporary, os.path.join(self.root, filename))
+
+        manifest = self.manifest()
+        manifest = {'models': list(manifest['models']), 'aliases': dict(manifest['aliases'])}
+        manifest['models'].append({
+            'id': model_id,
+            'kind': kind,
+            'file': filename,
+            'classes': classes,
+            'hyperparameters': hyperparameters or {},
+            'metrics': metrics or {},
+            'data_hash': data_hash,
+            'created': time.time(),
+        })
+        self._save_manifest(manifest)
+        return model_id
+
+    def set_alias(self, alias, model_id):
+        manifest = self.manifest()
+        if not any(entry['id'] == model_id for entry in manifest['models']):
+            raise KeyError(f"No model '{model_id}' in {self.root}")
+        manifest = {'models': list(manifest['models']), 'aliases': dict(manifest['aliases'], **{alias: model_id})}
+        self._save_manifest(manifest)
+
+    def entries(self, kind=None):
+        return [entry for entry in self.manifest()['models'] if kind is None or entry['kind'] == kind]
+
+    def resolve(self, name='best', kind=None):
+        """
+        Manifest entry a name refers to.
+
+        :param name: 'best', 'latest', an alias or a model ID.
+        :param kind: 'tree' or 'stumps'; limits 'best' and 'latest' to that kind.
+        :return: Manifest entry dict.
+        """
+        entries = self.entries(kind)
+        if name in ('best', 'latest') and entries:
+            if name == 'latest':
+                return max(entries, key=lambda entry: entry['created'])
+            # Highest accuracy; the newest model wins a tie
+            return max(entries, key=lambda entry: (entry['metrics'].get('accuracy', float('-inf')), entry['created']))
+        model_id = self.manifest()['aliases'].get(name, name)
+        for entry in entries:
+            if entry['id'] == model_id:
+                return entry
+        raise KeyError(f"No model '{name}' in {self.root}")
+
+    def load(self, name='best', kind=None):
+        # ModelFile of the resolved entry; repeated loads of the same model come from the cache
+        entry = self.resolve(name, kind)
+        model_id = entry['id']
+        if model_id in self._cache:
+            self._cache.move_to_end(model_id)
+            return self._cache[model_id]
+        model = load_model_file(os.path.join(self.root, entry['file']))
+        self._cache[model_id] = model
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return model
+
+_registries = {}
+
+def get_registry(root='models'):
+    # One registry, and so one model cache, per directory and process
+    root = os.path.abspath(root)
+    if root not in _registries:
+        _registries[root] = ModelRegistry(root)
+    return _registries[root]
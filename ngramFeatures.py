@@ -0,0 +1,106 @@
+import operator
+from collections import Counter
+from zlib import crc32
+
+from featureMatrix import SparseFeatureMatrix
+
+def hash_ngram(ngram, n_features):
+    # Stable across processes and runs, unlike the salted built-in hash() of str
+    return crc32(ngram.encode('utf-8')) % n_features
+
+class _NgramIndex(dict):
+    # n-gram -> dimension cache; misses are hashed on lookup, so lookups can run inside map()
+    def __init__(self, n_features, max_size):
+        super().__init__()
+        self.n_features = n_features
+        self.max_size = max_size
+
+    def __missing__(self, ngram):
+        if len(self) >= self.max_size:
+            self.clear()
+        index = self[ngram] = hash_ngram(ngram, self.n_features)
+        return index
+
+class NgramHasher:
+    """
+    Character n-gram features hashed into a fixed number of dimensions.
+
+    A segment is lowercased and padded with a space on each side, so word starts and ends
+    form n-grams of their own. Every n-gram of the requested orders is counted and added to
+    dimension crc32(ngram) % n_features; the value is the count divided by the padded
+    segment length, like the per-character features of featureExtraction. The n-grams are
+    counted with C-level zip/map/Counter passes and each distinct n-gram's dimension comes
+    from a bounded cache, so memory does not grow with the input.
+
+    :param n_features: Number of hashed dimensions, e.g. 2 ** 18.
+    :param ngram_range: Smallest and largest n-gram order, inclusive.
+    :param lowercase: Lowercase segments before counting.
+    :param cache_size: Maximum number of n-gram to dimension entries kept; the cache is
+                       emptied when it is full.
+    """
+    def __init__(self, n_features=1 << 18, ngram_range=(1, 4), lowercase=True, cache_size=1 << 20):
+        self.n_features = n_features
+        self.ngram_range = ngram_range
+        self.lowercase = lowercase
+        self.cache_size = cache_size
+        self._index = _NgramIndex(n_features, cache_size)
+
+    def _count(self, text):
+        counts = Counter()
+        low, high = self.ngram_range
+        for n in range(low, high + 1):
+            if n == 1:
+                counts.update(text)
+            elif n == 2:
+                counts.update(map(operator.add, text, text[1:]))
+            else:
+                counts.update(map(''.join, zip(*[text[k:] for k in range(n)])))
+        return counts
+
+    def transform_one(self, text):
+        """
+        Hashed n-gram vector of one segment.
+
+        :param text: Text segment; surrounding whitespace is ignored.
+        :return: {feature_index: value} dict of the non-zero dimensions.
+        """
+        text = text.strip()
+        if self.lowercase:
+            text = text.lower()
+        text = ' ' + text + ' '
+        counts = self._count(text)
+        indices = list(map(self._index.__getitem__, counts))
+        values = map((1 / len(text)).__mul__, counts.values())
+        row = dict(zip(indices, values))
+        if len(row) < len(indices):
+            # Some n-grams share a dimension: add their values up
+            row = {}
+            for index, value in zip(indices, map((1 / len(text)).__mul__, counts.values())):
+                row[index] = row.get(index, 0) + value
+        return row
+
+    def iter_rows(self, lines):
+        # Streams one sparse row per line
+        for line in lines:
+            yield self.transform_one(line)
+
+    def iter_chunks(self, lines, chunk_size=4096):
+        """
+        Streams lines into SparseFeatureMatrix chunks, so memory is bounded by chunk_size.
+
+        :param lines: Iterable of text segments, e.g. an open file.
+        :param chunk_size: Number of lines per chunk.
+        :return: Iterator of SparseFeatureMatrix chunks with one row per line.
+        """
+        rows = []
+        for line in lines:
+            rows.append(self.transform_one(line))
+            if len(rows) == chunk_size:
+                yield SparseFeatureMatrix.from_rows(rows, self.n_features)
+                rows = []
+        if rows:
+            yield SparseFeatureMatrix.from_rows(rows, self.n_features)
+
+    def transform(self, lines):
+        # Whole input as one SparseFeatureMatrix
+        return SparseFeatureMatrix.from_rows(self.iter_rows(lines), self.n_features)
@@ -0,0 +1,515 @@
+import hashlib
+import math
+import mmap
+import random
+import tempfile
+from array import array
+from bisect import bisect_left, bisect_right
+from itertools import islice, repeat
+
+from DecisionTree import Node, _entropy_from_counts, compile_tree
+from AdaBoostWithStumps import DecisionStump, OneVsAllAdaBoost, _learner_alpha, predict_multiclass_cascade
+from featureMatrix import FeatureMatrix
+from featureStore import is_feature_store, load_feature_store, read_text_features
+from instrumentation import phase
+
+# Out-of-core training. The feature file is never loaded as a whole: every step is a pass
+# over it in chunks of chunk_size rows.
+#
+#   scan      one pass: row and class counts, and a sketch of every feature giving its
+#             candidate thresholds (all distinct values when there are at most max_bins of
+#             them, otherwise max_bins quantiles of a fixed-size row sample)
+#   tree      one pass per tree level: the rows of every open node are counted per feature,
+#             threshold bin and class, and each node takes the best split of its histograms
+#   stumps    one pass per boosting round: weighted histograms per class, feature and bin;
+#             the sample weights live in a scratch file on disk, not in memory
+#
+# Memory depends on chunk_size, max_bins, sketch_size and memory_mb, never on the number of
+# rows. With at most max_bins distinct values per feature the trees are the ones build_tree
+# would grow on the same rows: the first row of every class and value in a node is tracked,
+# so its set-order tie-breaks for leaf labels and thresholds come out the same. The stumps
+# sum the same weights in another order, so when two stumps have (nearly) the same error
+# the pick can differ from find_best_stumps, and the ensembles diverge from that round on.
+
+def file_hash(path, block_size=1 << 20):
+    # Content hash of a training file, read in blocks
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def iter_feature_file(path, chunk_size=65536):
+    """
+    Streams a labelled feature file in chunks.
+
+    :param path: Text feature file ("lang: f1, f2, ...") or binary file from featureStore.py.
+                 Binary files are memory-mapped, so their chunks are views and never copies.
+    :param chunk_size: Number of rows per chunk.
+    :return: Iterator of (X, labels) with X a FeatureMatrix of at most chunk_size rows.
+    """
+    if is_feature_store(path):
+        store = load_feature_store(path)
+        if store.label_codes is None:
+            raise ValueError(f"{path} has no class labels")
+        try:
+            for start in range(0, len(store), chunk_size):
+                end = min(start + chunk_size, len(store))
+                X = FeatureMatrix([column[start:end] for column in store.X.columns], n_rows=end - start)
+                yield X, [store.labels[code] for code in store.label_codes[start:end]]
+                del X
+        finally:
+            store.close()
+        return
+
+    with open(path, 'r', encoding='utf-8') as file:
+        while True:
+            lines = list(islice(file, chunk_size))
+            if not lines:
+                break
+            X, labels = read_text_features(lines)
+            if len(X) == 0:
+                continue
+            if labels is None:
+                raise ValueError(f"{path} has no class labels")
+            yield X, labels
+
+class QuantileSketch:
+    """
+    Candidate thresholds of every feature, built in one pass.
+
+    Each feature keeps its set of distinct values until it holds more than max_bins of
+    them. Alongside, a reservoir of sketch_size rows is sampled uniformly (Algorithm L,
+    which skips ahead instead of drawing a random number per row); the quantiles of that
+    sample are used for features with more distinct values.
+
+    :param n_features: Number of features.
+    :param max_bins: Maximum number of thresholds per feature.
+    :param sketch_size: Number of rows kept in the reservoir.
+    :param seed: Seed of the reservoir sampling.
+    """
+    def __init__(self, n_features, max_bins=256, sketch_size=100000, seed=0):
+        self.max_bins = max_bins
+        self.sketch_size = sketch_size
+        self.rng = random.Random(seed)
+        self.distinct = [set() for _ in range(n_features)]
+        self.sample = [array('d') for _ in range(n_features)]
+        self.n_seen = 0
+        self._next = None
+        self._w = None
+
+    def _skip(self):
+        # Position of the next row that enters the reservoir
+        self._w *= math.exp(math.log(self.rng.random()) / self.sketch_size)
+        self._next += int(math.log(self.rng.random()) / math.log(1 - self._w)) + 1
+
+    def update(self, X):
+        for f, column in enumerate(X.columns):
+            distinct = self.distinct[f]
+            if distinct is None:
+                continue
+            distinct.update(column)
+            if len(distinct) > self.max_bins:
+                distinct = {value for value in distinct if value == value}  # NaN are all distinct
+                self.distinct[f] = distinct if len(distinct) <= self.max_bins else None
+
+        start, end = self.n_seen, self.n_seen + len(X)
+        if start < self.sketch_size:
+            fill = min(end, self.sketch_size) - start
+            for sample, column in zip(self.sample, X.columns):
+                sample.extend(column[:fill])
+            if start + fill == self.sketch_size:
+                self._next, self._w = self.sketch_size - 1, 1.0
+                self._skip()
+        if self._next is not None:
+            while self._next < end:
+                slot, i = self.rng.randrange(self.sketch_size), self._next - start
+                for sample, column in zip(self.sample, X.columns):
+                    sample[slot] = column[i]
+                self._skip()
+        self.n_seen = end
+
+    def thresholds(self, f):
+        # Sorted candidate thresholds of feature f
+        if self.distinct[f] is not None:
+            return sorted(value for value in self.distinct[f] if value == value)
+        values = sorted(value for value in self.sample[f] if value == value)
+        if not values:
+            return []
+        last = len(values) - 1
+        return sorted(set(values[last * k // (self.max_bins - 1)] for k in range(self.max_bins)))
+
+class StreamingDataset:
+    """
+    Labelled feature file read in chunks, with every validation_every-th row held out.
+
+    scan() makes the first pass. Afterwards classes, class_counts (of the training rows),
+    class_first (the order in which the classes first appear), n_train and the sketch are
+    known, and chunks() streams the training or validation rows
+    with their class codes as often as needed.
+
+    :param path: Text or binary feature file, see iter_feature_file.
+    :param chunk_size: Number of rows read at a time.
+    :param validation_every: Hold out row i when i % validation_every == 0; 0 keeps every row.
+    """
+    def __init__(self, path, chunk_size=65536, validation_every=5):
+        self.path = path
+        self.chunk_size = chunk_size
+        self.validation_every = validation_every
+        self.classes = None
+        self.class_counts = None
+        self.n_features = None
+        self.n_train = self.n_validation = 0
+        self.sketch = None
+
+    def _split(self, X, labels, start, validation):
+        every = self.validation_every
+        if not every:
+            return (None, None) if validation else (X, labels)
+        first = -start % every
+        if validation:
+            positions = range(first, len(X), every)
+        else:
+            positions = [i for i in range(len(X)) if (i - first) % every]
+        return X.take(positions), [labels[i] for i in positions]
+
+    def _rows(self, validation):
+        start = 0
+        for X, labels in iter_feature_file(self.path, self.chunk_size):
+            X_part, labels_part = self._split(X, labels, start, validation)
+            start += len(X)
+            if labels_part:
+                yield X_part, labels_part
+
+    def scan(self, max_bins=256, sketch_size=100000, seed=0):
+        counts = {}
+        n_rows = 0
+        with phase('scan', path=self.path) as timing:
+            for X, labels in iter_feature_file(self.path, self.chunk_size):
+                X_train, labels_train = self._split(X, labels, n_rows, validation=False)
+                n_rows += len(X)
+                if not labels_train:
+                    continue
+                if self.sketch is None:
+                    self.n_features = X.n_features
+                    self.sketch = QuantileSketch(X.n_features, max_bins, sketch_size, seed)
+                self.sketch.update(X_train)
+                for label in labels_train:
+                    counts[label] = counts.get(label, 0) + 1  # Keys in order of first appearance
+            self.n_train = sum(counts.values())
+            self.n_validation = n_rows - self.n_train
+            timing.add(rows=n_rows)
+        if not self.n_train:
+            raise ValueError(f"No training rows in {self.path}")
+        self.classes = sorted(counts)
+        self.class_counts = [counts[label] for label in self.classes]
+        self.class_first = [list(counts).index(label) for label in self.classes]
+        return self
+
+    def chunks(self, validation=False):
+        # (X, class codes, index of the first row among the training or validation rows)
+        class_codes = {label: code for code, label in enumerate(self.classes)}
+        start = 0
+        for X, labels in self._rows(validation):
+            yield X, [class_codes.get(label, -1) for label in labels], start
+            start += len(X)
+
+def _bin_columns(X, thresholds, side):
+    # Bin of every value: bisect_left puts x <= t[b] in bins 0..b (tree splits), bisect_right
+    # puts x < t[b] in bins 0..b (stumps). NaN goes to the last bin, past every threshold.
+    bins = []
+    for column, edges in zip(X.columns, thresholds):
+        binned = list(map(side, repeat(edges), column))
+        if side is bisect_left and any(map(math.isnan, column)):
+            binned = [len(edges) if value != value else b for value, b in zip(column, binned)]
+        bins.append(binned)
+    return bins
+
+def _majority(classes, counts, first):
+    # build_tree's max(set(node_y), key=node_y.count): the set is filled in order of first
+    # appearance, which decides both its iteration order and so the tie-break
+    present = sorted((first[c], c) for c in range(len(counts)) if counts[c])
+    count = dict(zip(classes, counts))
+    return max(set([classes[c] for _, c in present]), key=count.__getitem__)
+
+def _visit_order(first, base, n_bins, n_classes, edges):
+    # Rank of every threshold in set(column values of the node), as _best_split visits them
+    present = []
+    for b in range(n_bins):
+        block = first[base + b * n_classes:base + (b + 1) * n_classes]
+        first_row = min(block)
+        if first_row < _UNSEEN:
+            present.append((first_row, edges[b]))
+    present.sort()
+    return {value: rank for rank, value in enumerate(set([value for _, value in present]))}
+
+def _split_first(first, base, n_bins, n_classes, b):
+    # First row of every class in the left (bins 0..b) and right child of a split
+    left, right = [_UNSEEN] * n_classes, [_UNSEEN] * n_classes
+    for bin_index in range(n_bins + 1):
+        side = left if bin_index <= b else right
+        for c in range(n_classes):
+            row = first[base + bin_index * n_classes + c]
+            if row < side[c]:
+                side[c] = row
+    return left, right
+
+# First-row marker of a (bin, class) no row of the node has
+_UNSEEN = 1 << 62
+
+def _best_histogram_split(hist, first, offsets, thresholds, counts, min_samples_split):
+    # _best_split over the class counts of every threshold bin. The impurities are computed
+    # the same way, and equal scores are broken like it: the first feature, then within a
+    # feature the threshold that comes first in the set of the node's values
+    n_classes = len(counts)
+    n = sum(counts)
+    best_feature, best_threshold, best_bin, best_left, best_score = None, None, None, None, float('inf')
+    for f, edges in enumerate(thresholds):
+        base = offsets[f]
+        visit_order = None
+        best_rank = None
+        left_counts = [0] * n_classes
+        n_left = 0
+        for b, threshold in enumerate(edges):
+            block = hist[base + b * n_classes:base + (b + 1) * n_classes]
+            in_bin = sum(block)
+            if not in_bin:
+                continue  # No row of this node has this value
+            left_counts = [left + count for left, count in zip(left_counts, block)]
+            n_left += in_bin
+            n_right = n - n_left
+            if n_right < min_samples_split:
+                break
+            if n_left < min_samples_split:
+                continue
+            right_counts = [total - left for total, left in zip(counts, left_counts)]
+            impurity = n_left * _entropy_from_counts(left_counts, n_left) + n_right * _entropy_from_counts(right_counts, n_right)
+            if impurity < best_score:
+                best_feature, best_threshold, best_bin, best_left, best_score = f, threshold, b, left_counts, impurity
+                best_rank = None
+            elif impurity == best_score and best_feature == f:
+                if visit_order is None:
+                    visit_order = _visit_order(first, base, len(edges), n_classes, edges)
+                if best_rank is None:
+                    best_rank = visit_order[best_threshold]
+                if visit_order[threshold] < best_rank:
+                    best_threshold, best_bin, best_left, best_rank = threshold, b, left_counts, visit_order[threshold]
+    return best_feature, best_threshold, best_bin, best_left, best_score
+
+def _route(root, X, slots):
+    # Rows of X that reach each node of the current batch, following the splits made so far
+    stack = [(root, range(len(X)))]
+    while stack:
+        node, rows = stack.pop()
+        slot = slots.get(id(node))
+        if slot is not None:
+            yield slot, rows
+        elif node.left is not None:
+            column = X.column(node.feature_index)
+            threshold = node.threshold
+            left_rows = [i for i in rows if column[i] <= threshold]
+            right_rows = [i for i in rows if not column[i] <= threshold]
+            if left_rows:
+                stack.append((node.left, left_rows))
+            if right_rows:
+                stack.append((node.right, right_rows))
+
+def train_tree(dataset, max_depth=None, min_samples_split=2, memory_mb=256):
+    """
+    Grows a decision tree level by level, one pass over the training rows per level.
+
+    :param dataset: Scanned StreamingDataset.
+    :param max_depth: Maximum depth of the tree, None for no limit.
+    :param min_samples_split: Minimum number of rows to split a node, as in build_tree.
+    :param memory_mb: Memory for the node histograms; when a level has more open nodes than
+                      fit, it takes several passes.
+    :return: Root Node, usable wherever a tree from build_tree is.
+    """
+    classes = dataset.classes
+    n_classes = len(classes)
+    thresholds = [dataset.sketch.thresholds(f) for f in range(dataset.n_features)]
+    offsets = [0]
+    for edges in thresholds:
+        offsets.append(offsets[-1] + (len(edges) + 1) * n_classes)
+    # Per node: counts and first training row of every (feature, bin, class)
+    max_nodes = max(1, memory_mb * (1 << 20) // (16 * offsets[-1]))
+
+    root = Node()
+    open_nodes = [(root, 0, list(dataset.class_counts), list(dataset.class_first))]
+    with phase('stream_tree', rows=dataset.n_train, max_depth=max_depth, min_samples_split=min_samples_split):
+        while open_nodes:
+            batch, open_nodes = open_nodes[:max_nodes], open_nodes[max_nodes:]
+            splittable = []
+            for node, depth, counts, first in batch:
+                if max_depth is not None and depth >= max_depth or sum(counts) < min_samples_split:
+                    node.value = _majority(classes, counts, first)
+                else:
+                    splittable.append((node, depth, counts, first))
+            batch = splittable
+            if not batch:
+                continue
+
+            slots = {id(node): slot for slot, (node, _, _, _) in enumerate(batch)}
+            hists = [array('q', bytes(8 * offsets[-1])) for _ in batch]
+            firsts = [array('q', [_UNSEEN]) * offsets[-1] for _ in batch]
+            with phase('stream_pass', nodes=len(batch), depth=batch[0][1], rows=dataset.n_train):
+                for X, codes, start in dataset.chunks():
+                    bins = _bin_columns(X, thresholds, bisect_left)
+                    for slot, rows in _route(root, X, slots):
+                        hist, first = hists[slot], firsts[slot]
+                        for f, binned in enumerate(bins):
+                            base = offsets[f]
+                            keys = [base + binned[i] * n_classes + codes[i] for i in rows]
+                            for key in keys:
+                                hist[key] += 1
+                            # Built backwards, so every key keeps its first row
+                            for key, i in dict(zip(reversed(keys), reversed(rows))).items():
+                                if first[key] == _UNSEEN:
+                                    first[key] = start + i
+
+            for (node, depth, counts, node_first), hist, first in zip(batch, hists, firsts):
+                feature_index, threshold, b, left_counts, score = _best_histogram_split(hist, first, offsets, thresholds, counts, min_samples_split)
+                if score == float('inf'):
+                    node.value = _majority(classes, counts, node_first)
+                    continue
+                node.feature_index, node.threshold = feature_index, threshold
+                node.majority = _majority(classes, counts, node_first)
+                node.left, node.right = Node(), Node()
+                right_counts = [total - left for total, left in zip(counts, left_counts)]
+                left_first, right_first = _split_first(first, offsets[feature_index], len(thresholds[feature_index]), n_classes, b)
+                open_nodes.append((node.left, depth + 1, left_counts, left_first))
+                open_nodes.append((node.right, depth + 1, right_counts, right_first))
+    return root
+
+def _stump_predictions(stump, column):
+    polarity = stump.polarity
+    threshold = polarity * stump.threshold
+    return [1 if polarity * value < threshold else -1 for value in column]
+
+def train_one_vs_all(dataset, n_learners, classes=None, scratch_dir=None):
+    """
+    Trains one-vs-all AdaBoost stumps, one pass over the training rows per boosting round.
+
+    Every pass applies the previous round's stumps to the stored weights, writes them back
+    and adds them to per-class histograms of positive and negative weight per threshold bin;
+    each class then takes the stump with the lowest weighted error, the first feature and
+    lowest threshold on ties, like find_best_stumps on the same thresholds. The errors are
+    summed per bin rather than per sorted row, so errors that differ only by rounding can
+    pick another stump than the in-memory search.
+
+    :param dataset: Scanned StreamingDataset.
+    :param n_learners: Number of boosting rounds.
+    :param classes: Classes to train a model for, default every class in the data.
+    :param scratch_dir: Directory of the weight file (8 bytes per training row and class),
+                        default the system temporary directory.
+    :return: OneVsAllAdaBoost.
+    """
+    classes = list(classes or dataset.classes)
+    targets = [dataset.classes.index(cls) if cls in dataset.classes else -1 for cls in classes]
+    n = dataset.n_train
+    thresholds = [dataset.sketch.thresholds(f) for f in range(dataset.n_features)]
+    ensemble = OneVsAllAdaBoost(classes, n_learners=n_learners)
+    for model in ensemble.models:
+        model.learners = []
+
+    with tempfile.TemporaryFile(dir=scratch_dir) as scratch_file, phase('stream_stumps', rows=n, classes=len(classes)):
+        scratch_file.truncate(8 * n * len(classes))
+        scratch_map = mmap.mmap(scratch_file.fileno(), 8 * n * len(classes)) if n_learners > 1 else None
+        scratch = memoryview(scratch_map).cast('d') if scratch_map is not None else None
+        sums = [1.0 for _ in classes]  # Sum of the stored weights of each class, for normalizing
+        try:
+            for round_index in range(n_learners):
+                pos_hists = [[array('d', bytes(8 * (len(edges) + 1))) for edges in thresholds] for _ in classes]
+                neg_hists = [[array('d', bytes(8 * (len(edges) + 1))) for edges in thresholds] for _ in classes]
+                new_sums = [0.0 for _ in classes]
+                with phase('stream_pass', round=round_index, rows=n):
+                    for X, codes, start in dataset.chunks():
+                        bins = _bin_columns(X, thresholds, bisect_right)
+                        for k, (model, target) in enumerate(zip(ensemble.models, targets)):
+                            y = [1 if code == target else -1 for code in codes]
+                            if round_index == 0:
+                                w = [1 / n] * len(y)
+                            else:
+                                # Weights of the last round, then the update of its stump
+                                if round_index == 1:
+                                    w = [1 / n] * len(y)
+                                else:
+                                    w_sum = sums[k]
+                                    w = [w_i / w_sum for w_i in scratch[k * n + start:k * n + start + len(y)]]
+                                learner = model.learners[-1]
+                                predictions = _stump_predictions(learner, X.column(learner.feature_index))
+                                alpha = learner.alpha
+                                w = [w_i * ((-alpha * y_i * p) + 1) for w_i, y_i, p in zip(w, y, predictions)]
+                                if round_index < n_learners - 1:
+                                    scratch[k * n + start:k * n + start + len(y)] = array('d', w)
+                                new_sums[k] = sum(w, new_sums[k])
+                            for binned, pos_hist, neg_hist in zip(bins, pos_hists[k], neg_hists[k]):
+                                for b, w_i, y_i in zip(binned, w, y):
+                                    if y_i == 1:
+                                        pos_hist[b] += w_i
+                                    else:
+                                        neg_hist[b] += w_i
+                if round_index > 0:
+                    sums = new_sums
+
+                for k, model in enumerate(ensemble.models):
+                    # Same sweep as find_best_stumps, over the bins of every feature
+                    scale = sums[k] if round_index > 0 else 1.0
+                    best = (None, None, 1, float('inf'))
+                    # One total for every feature, so stumps with nothing below their threshold
+                    # tie exactly and the first feature wins, as in find_best_stumps
+                    pos_total = sum(pos_hists[k][0]) / scale if thresholds else 0.0
+                    for f, edges in enumerate(thresholds):
+                        pos_hist, neg_hist = pos_hists[k][f], neg_hists[k][f]
+                        pos_below = neg_below = 0.0
+                        for b, threshold in enumerate(edges):
+                            pos_below += pos_hist[b] / scale
+                            neg_below += neg_hist[b] / scale
+                            p = 1
+                            error = neg_below + (pos_total - pos_below)
+                            if error > 0.5:
+                                error = 1 - error
+                                p = -1
+                            if error < best[3]:
+                                best = (f, threshold, p, error)
+                    learner = DecisionStump()
+                    learner.feature_index, learner.threshold, learner.polarity, min_error = best
+                    learner.alpha = _learner_alpha(min_error)
+                    model.learners.append(learner)
+        finally:
+            if scratch is not None:
+                scratch.release()
+                scratch_map.close()
+    return ensemble
+
+def evaluate(dataset, tree=None, ensemble=None):
+    """
+    Accuracy on the held-out rows, in one pass.
+
+    :return: Dict with 'tree' (accuracy of the tree), 'multiclass' (accuracy of the ensemble's
+             highest-margin class, as predict_multiclass gives it) and 'class_accuracy' (binary
+             accuracy of every one-vs-all model, as hyperparameter_tuning_for_adab reports it).
+    """
+    compiled = compile_tree(tree) if tree is not None else None
+    tree_correct, multiclass_correct, total = 0, 0, 0
+    class_correct = [0 for _ in ensemble.classes] if ensemble is not None else []
+    with phase('stream_evaluate', rows=dataset.n_validation):
+        for X, codes, _ in dataset.chunks(validation=True):
+            labels = [dataset.classes[code] if code >= 0 else None for code in codes]
+            total += len(labels)
+            if compiled is not None:
+                tree_correct += sum(1 for predicted, label in zip(compiled.predict(X), labels) if predicted == label)
+            if ensemble is not None:
+                predictions = predict_multiclass_cascade(ensemble.models, X, ensemble.classes)
+                multiclass_correct += sum(1 for predicted, label in zip(predictions, labels) if predicted == label)
+                for k, (cls, model) in enumerate(zip(ensemble.classes, ensemble.models)):
+                    class_correct[k] += sum(1 for predicted, label in zip(model.predict(X), labels) if (predicted == 1) == (label == cls))
+    if not total:
+        return {}
+    metrics = {}
+    if compiled is not None:
+        metrics['tree'] = tree_correct / total
+    if ensemble is not None:
+        metrics['multiclass'] = multiclass_correct / total
+        metrics['class_accuracy'] = {cls: correct / total for cls, correct in zip(ensemble.classes, class_correct)}
+    return metrics
@@ -1,40 +1,145 @@
 import xml.etree.ElementTree as ET
+import bz2
+import gzip
 import json
 import argparse
 
-def parse_abstracts(xml_file):
-    abstracts = []
+def open_dump(xml_file):
+    # Open a dump for binary reading, decompressing .gz and .bz2 files on the fly
+    if xml_file.endswith('.gz'):
+        return gzip.open(xml_file, 'rb')
+    if xml_file.endswith('.bz2'):
+        return bz2.open(xml_file, 'rb')
+    return open(xml_file, 'rb')
+
+def iter_abstracts(xml_file):
+    """
+    Streams the abstracts of a dump one <doc> at a time.
+
+    Each <doc> element is cleared, and dropped from the root, as soon as its record has been
+    produced, so memory stays flat however large the dump is and the first records are
+    available before the file has been read.
 
-    tree = ET.parse(xml_file)
-    root = tree.getroot()
+    :param xml_file: Path of the XML dump, optionally .gz or .bz2 compressed.
+    :return: Iterator of {'title', 'url', 'abstract'} dicts in document order.
+    """
+    with open_dump(xml_file) as source:
+        root = None
+        for event, elem in ET.iterparse(source, events=('start', 'end')):
+            if event == 'start':
+                if root is None:
+                    root = elem
+                continue
+            if elem.tag != 'doc':
+                continue
 
-    for doc in root.iter('doc'):
-        title = doc.find('title').text.strip()
-        url = doc.find('url').text.strip()
-        abstract_element = doc.find('abstract')
-        if abstract_element is not None and abstract_element.text is not None:
-            abstract = abstract_element.text.strip()
-        else:
-            abstract = ""
-        abstract_data = {
-            'title': title,
-            'url': url,
-            'abstract': abstract
-        }
+            yield doc_to_abstract(elem)
 
-        abstracts.append(abstract_data)
+            elem.clear()
+            root.clear()
 
-    return abstracts
+def doc_to_abstract(doc):
+    # Record of one <doc> element
+    title = doc.find('title').text.strip()
+    url = doc.find('url').text.strip()
+    abstract_element = doc.find('abstract')
+    if abstract_element is not None and abstract_element.text is not None:
+        abstract = abstract_element.text.strip()
+    else:
+        abstract = ""
+    return {
+        'title': title,
+        'url': url,
+        'abstract': abstract
+    }
+
+def parse_abstracts(xml_file):
+    return list(iter_abstracts(xml_file))
 
 def save_abstracts_to_json(abstracts, json_file):
+    # Writes the same text as json.dump(abstracts, indent=4), one record at a time
     with open(json_file, 'w', encoding='utf-8') as file:
-        json.dump(abstracts, file, ensure_ascii=False, indent=4)
+        first = True
+        for abstract_data in abstracts:
+            record = json.dumps(abstract_data, ensure_ascii=False, indent=4).replace('\n', '\n    ')
+            file.write(('[\n    ' if first else ',\n    ') + record)
+            first = False
+        file.write('[]' if first else '\n]')
+
+def save_abstracts_to_ndjson(abstracts, ndjson_file, flush_every=100):
+    """
+    Writes abstracts as newline-delimited JSON, one record per line, as they arrive.
+
+    :param abstracts: Iterable of abstract dicts, e.g. iter_abstracts(xml_file).
+    :param ndjson_file: Output file name.
+    :param flush_every: Flush after this many records so readers see them early.
+    :return: Number of records written.
+    """
+    count = 0
+    with open(ndjson_file, 'w', encoding='utf-8') as file:
+        for abstract_data in abstracts:
+            file.write(json.dumps(abstract_data, ensure_ascii=False) + '\n')
+            count += 1
+            if count % flush_every == 0:
+                file.flush()
+    return count
+
+def iter_abstracts_from_json(json_file, chunk_size=1 << 16):
+    """
+    Streams abstract records from a JSON array file or a newline-delimited JSON file.
+
+    JSON arrays (as written by save_abstracts_to_json) are decoded one element at a time
+    from a rolling buffer, so neither format is ever loaded whole.
+
+    :param json_file: Path of the .json or .ndjson abstracts file.
+    :param chunk_size: Number of characters read at a time from a JSON array file.
+    :return: Iterator of abstract dicts in file order.
+    """
+    decoder = json.JSONDecoder()
+    with open(json_file, 'r', encoding='utf-8') as file:
+        buffer = file.read(chunk_size)
+        stripped = buffer.lstrip()
+        if not stripped.startswith('['):
+            # Newline-delimited JSON: one record per non-empty line
+            file.seek(0)
+            for line in file:
+                if line.strip():
+                    yield json.loads(line)
+            return
+
+        buffer = stripped[1:]
+        pos = 0
+        eof = False
+        while True:
+            # Skip separators between elements
+            while pos < len(buffer) and (buffer[pos].isspace() or buffer[pos] == ','):
+                pos += 1
+            if pos < len(buffer) and buffer[pos] == ']':
+                return
+            try:
+                record, end = decoder.raw_decode(buffer, pos)
+                if end == len(buffer) and not eof:
+                    raise ValueError("Element may continue in the next chunk")
+            except ValueError:
+                if eof:
+                    raise
+                chunk = file.read(chunk_size)
+                eof = not chunk
+                buffer = buffer[pos:] + chunk
+                pos = 0
+                continue
+            yield record
+            pos = end
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Parse XML file and save abstracts to JSON')
-    parser.add_argument('xml_file', type=str, help='Input XML file name')
+    parser.add_argument('xml_file', type=str, help='Input XML file name, may be .gz or .bz2 compressed')
     parser.add_argument('json_file', type=str, help='Output JSON file name')
+    parser.add_argument('--ndjson', action='store_true', help='Write newline-delimited JSON records instead of one JSON array')
     args = parser.parse_args()
 
-    abstracts = parse_abstracts(args.xml_file)
-    save_abstracts_to_json(abstracts, args.json_file)
+    abstracts = iter_abstracts(args.xml_file)
+    if args.ndjson:
+        save_abstracts_to_ndjson(abstracts, args.json_file)
+    else:
+        save_abstracts_to_json(abstracts, args.json_file)
@@ -0,0 +1,144 @@
+import json
+import queue
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+class _Request:
+    # Lines of one client request and the slot its results are put in
+    def __init__(self, lines):
+        self.lines = lines
+        self.labels = None
+        self.scores = None
+        self.error = None
+        self.done = threading.Event()
+
+class PredictionBatcher:
+    """
+    Collects the lines of concurrent requests into batches scored by one call.
+
+    A single worker thread takes the first waiting request, then keeps adding requests
+    for up to max_wait seconds or until max_batch lines are queued, scores all their
+    lines together and hands every request its own slice of the results.
+
+    :param score: Function mapping a list of lines to (labels, scores) lists.
+    :param max_batch: Maximum number of lines per batch; larger requests form their own batch.
+    :param max_wait: Seconds to wait for more requests after the first one arrives.
+    """
+    def __init__(self, score, max_batch=4096, max_wait=0.002):
+        self.score = score
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def predict(self, lines):
+        # Blocks until the batch holding these lines has been scored
+        request = _Request(lines)
+        self._queue.put(request)
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.labels, request.scores
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        n_lines = len(batch[0].lines)
+        deadline = time.monotonic() + self.max_wait
+        while n_lines < self.max_batch:
+            timeout = deadline - time.monotonic()
+            try:
+                request = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            batch.append(request)
+            n_lines += len(request.lines)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            lines = [line for request in batch for line in request.lines]
+            try:
+                labels, scores = self.score(lines)
+            except Exception:
+                # Score every request on its own, so one bad request does not fail the others
+                for request in batch:
+                    try:
+                        request.labels, request.scores = self.score(request.lines)
+                    except Exception as error:
+                        request.error = error
+                    request.done.set()
+                continue
+            start = 0
+            for request in batch:
+                end = start + len(request.lines)
+                request.labels, request.scores = labels[start:end], scores[start:end]
+                request.done.set()
+                start = end
+
+class _PredictionHandler(BaseHTTPRequestHandler):
+    # POST /predict with {"lines": [...]} or plain text, one segment per line
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        if self.path == '/health':
+            self._reply(200, {'status': 'ok'})
+        else:
+            self._reply(404, {'error': 'not found'})
+
+    def do_POST(self):
+        if self.path != '/predict':
+            self._reply(404, {'error': 'not found'})
+            return
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+        except ValueError:
+            self.close_connection = True  # The body cannot be skipped without its length
+            self._reply(400, {'error': 'invalid Content-Length'})
+            return
+        try:
+            body = self.rfile.read(length).decode('utf-8')
+        except UnicodeDecodeError:
+            self._reply(400, {'error': 'body is not UTF-8'})
+            return
+        if self.headers.get('Content-Type', '').startswith('application/json'):
+            try:
+                lines = json.loads(body)['lines']
+            except (ValueError, KeyError, TypeError):
+                lines = None
+            if not isinstance(lines, list) or not all(isinstance(line, str) for line in lines):
+                self._reply(400, {'error': 'expected {"lines": [...]} with a list of strings'})
+                return
+        else:
+            lines = body.splitlines()
+        try:
+            labels, scores = self.server.batcher.predict(lines)
+        except Exception as error:
+            self._reply(500, {'error': f'prediction failed: {error}'})
+            return
+        self._reply(200, {'predictions': [{'label': label, 'scores': score} for label, score in zip(labels, scores)]})
+
+    def _reply(self, status, payload):
+        data = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass  # One line per request would cost more than the prediction
+
+def make_server(score, host='127.0.0.1', port=8000, max_batch=4096, max_wait=0.002):
+    """
+    HTTP prediction server around an already loaded model.
+
+    :param score: Function mapping a list of lines to (labels, scores) lists.
+    :return: ThreadingHTTPServer; call serve_forever() to start it.
+    """
+    server = ThreadingHTTPServer((host, port), _PredictionHandler)
+    server.daemon_threads = True
+    server.batcher = PredictionBatcher(score, max_batch, max_wait)
+    return server
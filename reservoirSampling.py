@@ -0,0 +1,52 @@
+import random
+
+class Reservoir:
+    """
+    Uniform random sample of at most `size` items from a stream of unknown length.
+
+    Every item offered with add() ends up in `items` with the same probability, using
+    O(size) memory (Algorithm R). `seen` counts all items offered so far.
+    """
+    def __init__(self, size, rng=None):
+        self.size = size
+        self.rng = rng if rng is not None else random.Random()
+        self.items = []
+        self.seen = 0
+
+    def add(self, item):
+        self.seen += 1
+        if len(self.items) < self.size:
+            self.items.append(item)
+        else:
+            slot = self.rng.randrange(self.seen)
+            if slot < self.size:
+                self.items[slot] = item
+
+def merge_reservoirs(samples, size, rng=None):
+    """
+    Combines reservoirs filled from disjoint parts of one stream into a single sample.
+
+    Items are drawn one at a time from a part chosen with probability proportional to the
+    part's remaining unseen count, which gives the same distribution as one reservoir of
+    `size` run over the whole stream.
+
+    :param samples: List of (seen, items) pairs, items being a uniform sample of min(size, seen).
+    :param size: Size of the merged sample.
+    :param rng: random.Random to draw with.
+    :return: List of at most `size` items.
+    """
+    rng = rng if rng is not None else random.Random()
+    remaining = [seen for seen, _ in samples]
+    pools = [rng.sample(items, len(items)) for _, items in samples]
+    total = sum(remaining)
+    merged = []
+    for _ in range(min(size, total)):
+        draw = rng.randrange(total)
+        part = 0
+        while draw >= remaining[part]:
+            draw -= remaining[part]
+            part += 1
+        merged.append(pools[part].pop())
+        remaining[part] -= 1
+        total -= 1
+    return merged
@@ -1,148 +1,360 @@
 import argparse
+import os
 import sys
 
 from loadData import *
 from DecisionTree import *
 from AdaBoostWithStumps import *
 from featureExtraction import *
-def hyperparameter_tuning_process(data,sample_size= 1000):
+from featureMatrix import *
+from gridSearch import *
+from featureStore import *
+from predictionServer import make_server
+from batchPredict import batch_predict
+from modelFormat import *
+from modelRegistry import *
+from datasetCache import get_dataset_cache
+from outOfCore import StreamingDataset, evaluate, file_hash, train_one_vs_all, train_tree
+import instrumentation
+from instrumentation import phase
+def hyperparameter_tuning_process(data,sample_size= 1000, workers=None, registry_dir='models', split=None):
     print(f"Processing sample size: {sample_size}")
 
-    sampled_data = sample_data(data, sample_size)
-    X, y = process_raw_data(sampled_data)
-    X_train, y_train, X_test, y_test = split_data(X, y)
+    if split is not None:
+        # Cached sample, already parsed and split
+        X_train, y_train, X_test, y_test = split.arrays()
+        data_hash = split.key
+    else:
+        with phase('sampling', rows=sample_size):
+            sampled_data = sample_training_data(data, sample_size)
+        with phase('preprocessing', rows=len(sampled_data)):
+            if isinstance(sampled_data, FeatureStore):
+                X, y = sampled_data.X, sampled_data.label_list()
+            else:
+                X, y = process_raw_data(sampled_data)
+            X_train, y_train, X_test, y_test = split_data(X, y)
+        data_hash = dataset_hash(X, y)
 
     ## Calculate mean and standard deviation for normalization
     #means, stds = calculate_mean_std(X_train)
     #X_train = normalize_data(X_train, means, stds)
     #X_test = normalize_data(X_test, means, stds)
 
+    max_depths, min_samples_splits = tree_grid(sample_size)
+
+    # Perform hyperparameter tuning
+    with phase('tuning', rows=len(y_train), grid_points=len(max_depths) * len(min_samples_splits)):
+        result = parallel_hyperparameter_tuning(X_train, y_train, X_test, y_test, max_depths, min_samples_splits, workers=workers)
+    report_tree(result, sample_size, data_hash, registry_dir)
+
+def tree_grid(sample_size):
+    # (max_depths, min_samples_splits) tried for a sample size
     # Adjust min_samples_splits based on sample size
     min_samples_splits = [int(sample_size * p) for p in [0.01, 0.02, 0.05]]
     max_depths = [3, 4, 5]
+    return max_depths, min_samples_splits
 
-    # Perform hyperparameter tuning
-    best_max_depth, best_min_samples_split, best_accuracy, best_tree = hyperparameter_tuning(X_train, y_train, X_test, y_test, max_depths, min_samples_splits)
-
+def report_tree(result, sample_size, data_hash, registry_dir='models'):
+    # Print, save and register the best tree of parallel_hyperparameter_tuning
+    best_max_depth, best_min_samples_split, best_accuracy, best_tree = result
     print("Best Max Depth:", best_max_depth)
     print("Best Min Sample Split:", best_min_samples_split)
     print("Best Accuracy:", best_accuracy)
 
-    model_filename = f"tree_sample_size_{sample_size}_acc_{best_accuracy}_max_dep_{best_max_depth}_min_split_{best_min_samples_split}.pkl"
-    save_model_with_pickle(best_tree, model_filename)
-    print(f"Model saved as '{model_filename}'")
-
-def hyperparameter_tuning_for_adab(data, sample_size):
-    
+    with phase('save'):
+        model_filename = f"tree_sample_size_{sample_size}_acc_{best_accuracy}_max_dep_{best_max_depth}_min_split_{best_min_samples_split}.pkl"
+        save_model_with_pickle(best_tree, model_filename)
+        print(f"Model saved as '{model_filename}'")
+        model_id = get_registry(registry_dir).register(
+            best_tree,
+            hyperparameters={'sample_size': sample_size, 'max_depth': best_max_depth, 'min_samples_split': best_min_samples_split},
+            metrics={'accuracy': best_accuracy},
+            data_hash=data_hash)
+    print(f"Model registered as '{model_id}' in '{registry_dir}'")
+
+LEARNER_VALUES = [10, 15, 50, 100]
+
+def hyperparameter_tuning_for_adab(data, sample_size, languages=("it", "nl", "en"), workers=None, registry_dir='models', split=None):
+    # One sample, one split and one shared boosting run for all one-vs-all language models
     print(f"Processing sample size: {sample_size}")
+    if split is not None:
+        # Cached sample; the one-vs-all labels are derived from its stored labels, not parsed
+        X_train, labels_train, X_test, labels_test = split.arrays()
+        data_hash = split.key
+    else:
+        with phase('sampling', rows=sample_size):
+            sampled_data = sample_training_data(data, sample_size)
+        with phase('preprocessing', rows=len(sampled_data)):
+            X, labels = preprocess_for_multiclass_classification(sampled_data)
+            X_train, labels_train, X_test, labels_test = train_test_split(X, labels)
+        data_hash = dataset_hash(X, labels)
+
+    with phase('tuning', rows=len(labels_train), classes=len(languages)):
+        results = parallel_tune_number_of_learners_multiclass(X_train, labels_train, X_test, labels_test, languages, LEARNER_VALUES, workers=workers)
+    report_adaboost(results, languages, X_test, labels_test, sample_size, data_hash, registry_dir)
+
+def report_adaboost(results, languages, X_test, labels_test, sample_size, data_hash, registry_dir='models'):
+    # Print, save and register the one-vs-all models of parallel_tune_number_of_learners_multiclass
+    n_learners, accuracies = {}, {}
+    for language, (best_n_learners, best_accuracy, best_ada_model) in zip(languages, results):
+        n_learners[language] = best_n_learners
+        accuracies[language] = best_accuracy
+        print()
+        print(f"Results for {language}:")
+        print(f"Best number of learners: {best_n_learners}")
+        print("Best Accuracy:", best_accuracy)
+
+        with phase('save'):
+            model_filename = f"{language.upper()}_adab_sample_size_{sample_size}_acc_{best_accuracy}_n_learners_{best_n_learners}.pkl"
+            save_adaboost_model(best_ada_model, model_filename)
+        print(f"Model saved as '{model_filename}'")
+
+    # All languages as one registry entry, ranked by the accuracy of what predict does: the
+    # class of the highest margin
+    models = [model for _, _, model in results]
+    with phase('validation', rows=len(labels_test)):
+        predictions = predict_multiclass(models, X_test, languages)
+        accuracy = sum(1 for predicted, label in zip(predictions, labels_test) if predicted == label) / len(labels_test)
     print()
-    print("Training for italian:")
-    sampled_data = sample_data(data, sample_size)
-    X, y = preprocess_for_binary_classification(sampled_data, "it")
-
-    X_train, y_train, X_test, y_test = train_test_split(X, y)
-    learner_values = [10, 15, 50, 100]
-
-    best_n_learners, best_accuracy, best_ada_model = tune_number_of_learners(X_train, y_train, X_test, y_test, learner_values)
-    print(f"Best number of learners: {best_n_learners}")
-    print("Best Accuracy:", best_accuracy)
-
-    model_filename = f"IT_adab_sample_size_{sample_size}_acc_{best_accuracy}_n_learners_{best_n_learners}.pkl"
-    save_adaboost_model(best_ada_model, model_filename)
-    print(f"Model saved as '{model_filename}'")
-
-    X, y = preprocess_for_binary_classification(sampled_data, "nl")
-
-    X_train, y_train, X_test, y_test = train_test_split(X, y)
-    learner_values = [10, 15, 50, 100]
-
-    best_n_learners, best_accuracy, best_ada_model = tune_number_of_learners(X_train, y_train, X_test, y_test, learner_values)
-    print(f"Best number of learners: {best_n_learners}")
-    print("Best Accuracy:", best_accuracy)
-
-    model_filename = f"NL_adab_sample_size_{sample_size}_acc_{best_accuracy}_n_learners_{best_n_learners}.pkl"
-    save_adaboost_model(best_ada_model, model_filename)
-    print(f"Model saved as '{model_filename}'")
-
-    X, y = preprocess_for_binary_classification(sampled_data, "en")
-
-    X_train, y_train, X_test, y_test = train_test_split(X, y)
-    learner_values = [10, 15, 50, 100]
-
-    best_n_learners, best_accuracy, best_ada_model = tune_number_of_learners(X_train, y_train, X_test, y_test, learner_values)
-    print(f"Best number of learners: {best_n_learners}")
-    print("Best Accuracy:", best_accuracy)
-
-    model_filename = f"EN_adab_sample_size_{sample_size}_acc_{best_accuracy}_n_learners_{best_n_learners}.pkl"
-    save_adaboost_model(best_ada_model, model_filename)
-    print(f"Model saved as '{model_filename}'")
-
-def train_model(sample_size):
-    # Load data
-    data = load_data()
+    print("Multiclass Accuracy:", accuracy)
+    with phase('save'):
+        model_id = get_registry(registry_dir).register(
+            models,
+            classes=list(languages),
+            hyperparameters={'sample_size': sample_size, 'n_learners': n_learners},
+            metrics={'accuracy': accuracy, 'class_accuracy': accuracies},
+            data_hash=data_hash)
+    print(f"Models registered as '{model_id}' in '{registry_dir}'")
+
+def load_training_data(data_file=None):
+    # Binary feature files are memory-mapped; text feature files are read as lines
+    if data_file is None:
+        return load_data()
+    if is_feature_store(data_file):
+        return load_feature_store(data_file)
+    with open(data_file, 'r', encoding='utf-8') as infile:
+        return [line for line in infile if line.strip()]
+
+def sample_training_data(data, sample_size):
+    if isinstance(data, FeatureStore):
+        return data.sample(sample_size)
+    return sample_data(data, sample_size)
+
+def train_model(sample_size, workers=None, data_file=None, registry_dir='models', seed=0, cache_dir='.dataset_cache'):
+    # Load data; with a dataset cache, a split made before with the same data, sample size
+    # and seed is reused without parsing the data again
+    split = None
+    if cache_dir is None:
+        with phase('load_data'):
+            data = load_training_data(data_file)
+    else:
+        data = None
+        # A --data file is keyed by its modification time and size; the default data is
+        # loaded and keyed by the hash of its lines
+        source = data_file if data_file is not None else load_training_data()
+        split = get_dataset_cache(cache_dir).split(source, sample_size, seed=seed, load=load_training_data)
+        print(f"Dataset '{split.key[:12]}': {len(split.train)} training and {len(split.test)} validation rows")
+    print(f"Processing sample size: {sample_size}")
+    if split is not None:
+        X_train, labels_train, X_test, labels_test = split.arrays()
+        data_hash = split.key
+    else:
+        with phase('sampling', rows=sample_size):
+            sampled_data = sample_training_data(data, sample_size)
+        with phase('preprocessing', rows=len(sampled_data)):
+            X, labels = preprocess_for_multiclass_classification(sampled_data)
+            X_train, labels_train, X_test, labels_test = train_test_split(X, labels)
+        data_hash = dataset_hash(X, labels)
+
+    # The tree grid and the boosting classes share one process pool, so they run side by side
+    languages = ("it", "nl", "en")
+    max_depths, min_samples_splits = tree_grid(sample_size)
+    with phase('tuning', rows=len(labels_train), grid_points=len(max_depths) * len(min_samples_splits), classes=len(languages)):
+        tree_result, adaboost_results = parallel_tuning(X_train, labels_train, X_test, labels_test, max_depths, min_samples_splits,
+                                                        languages, LEARNER_VALUES, workers=workers)
     print("Training Decision Tree")
-    hyperparameter_tuning_process(data,sample_size)
+    with phase('train_tree', sample_size=sample_size):
+        report_tree(tree_result, sample_size, data_hash, registry_dir)
     print()
     print("Training AdaBoost")
-    hyperparameter_tuning_for_adab(data,sample_size)
+    with phase('train_adaboost', sample_size=sample_size):
+        report_adaboost(adaboost_results, languages, X_test, labels_test, sample_size, data_hash, registry_dir)
 
-    pass
 
+def train_out_of_core(data_file, max_depth=5, min_samples_split=None, n_learners=50, languages=("it", "nl", "en"),
+                      chunk_size=65536, max_bins=256, memory_mb=256, registry_dir='models'):
+    # Trains on the whole feature file in passes over chunks instead of on a sample in memory
+    dataset = StreamingDataset(data_file, chunk_size=chunk_size).scan(max_bins=max_bins)
+    print(f"Training rows: {dataset.n_train}, validation rows: {dataset.n_validation}")
+    if min_samples_split is None:
+        min_samples_split = max(2, dataset.n_train // 100)
+    data_hash = file_hash(data_file)
+    registry = get_registry(registry_dir)
 
-def predict_multiclass(models, X):
+    print("Training Decision Tree")
+    with phase('train_tree', rows=dataset.n_train):
+        tree = train_tree(dataset, max_depth=max_depth, min_samples_split=min_samples_split, memory_mb=memory_mb)
+    print()
+    print("Training AdaBoost")
+    with phase('train_adaboost', rows=dataset.n_train):
+        ensemble = train_one_vs_all(dataset, n_learners, classes=languages)
+    metrics = evaluate(dataset, tree, ensemble)
+
+    common = {'rows': dataset.n_train, 'out_of_core': True, 'max_bins': max_bins}
+    tree_id = registry.register(
+        tree,
+        hyperparameters=dict(common, max_depth=max_depth, min_samples_split=min_samples_split),
+        metrics={'accuracy': metrics.get('tree')},
+        data_hash=data_hash)
+    print("Tree Accuracy:", metrics.get('tree'))
+    print(f"Model registered as '{tree_id}' in '{registry_dir}'")
+
+    class_accuracy = metrics.get('class_accuracy', {})
+    stumps_id = registry.register(
+        ensemble.models,
+        classes=list(languages),
+        hyperparameters=dict(common, n_learners={language: n_learners for language in languages}),
+        metrics={'accuracy': metrics.get('multiclass'), 'class_accuracy': class_accuracy},
+        data_hash=data_hash)
+    for language, accuracy in class_accuracy.items():
+        print(f"Accuracy for {language}:", accuracy)
+    print("Multiclass Accuracy:", metrics.get('multiclass'))
+    print(f"Models registered as '{stumps_id}' in '{registry_dir}'")
+
+def predict_multiclass(models, X, class_labels=('it', 'nl', 'en'), early_exit=True):
     """
     Predicts class labels for samples using multiple AdaBoost models in a One-vs-All strategy.
 
     Parameters:
     models (list): A list of AdaBoost models where each model is trained to identify a specific class.
     X (list of lists): Input samples to be classified. Each sample is a list of feature values.
+    class_labels (sequence): Class of each model, in the same order as models.
+    early_exit (bool): Stop scoring a sample once its class is settled (predict_multiclass_cascade).
+                       The predictions are the same either way.
 
     Returns:
-    list: Predicted class labels for each input sample. The label corresponds to the model with the highest score.
+    list: Predicted class labels for each input sample. The label corresponds to the model with the highest margin.
 
     Example:
     >>> y_pred = predict_multiclass(models, X_test)
     """
 
+    if early_exit:
+        return predict_multiclass_cascade(models, X, class_labels)
     predictions = []
-    class_labels = ['it', 'nl', 'en']
-    for sample in X:
-        # Get the prediction score for each class
-        scores = [model.predict([sample])[0] for model in models]
+    X = as_feature_matrix(X)
+    # Compare the raw margins of the whole batch, not the tie-prone +1/-1 predictions
+    model_scores = [model.decision_function(X) for model in models]
+    for scores in zip(*model_scores):
+        scores = list(scores)
         # Choose the class with the highest score
         predicted_class = scores.index(max(scores))
         predictions.append(class_labels[predicted_class])
     return predictions
 
 
-def predict_all(model_type, datafile):
-    extract(datafile)
-    X_test = []
-    with open("input_feature.txt", 'r', encoding='utf-8') as infile:
-        for line in infile:
-            if line.strip():  # Skip empty lines
-                features = [float(x.strip()) for x in line.split(',') if x.strip()]
-
-                # Append the processed data
-                X_test.append(features)
+def registry_for(model_type, model_file=None, registry_dir='models'):
+    # Registry to resolve the model from, or None for a model file or the legacy pickles
+    if model_file is not None and os.path.isfile(model_file):
+        return None
+    registry = get_registry(registry_dir)
+    if registry.entries('tree' if model_type == 'tree' else 'stumps'):
+        return registry
+    return None
 
+def load_prediction_model(model_type, model_file=None, registry_dir='models'):
+    """
+    Loads the model to predict with.
+
+    :param model_type: 'tree', 'stumps' or 'best' (the AdaBoost models).
+    :param model_file: Binary model file or pickled tree, or a registry name ('best',
+                       'latest', an alias or a model ID). Default is the registry's best model.
+    :param registry_dir: Model registry directory; without registered models of this type
+                         the original pickles are loaded.
+    :return: ModelFile holding the compiled tree or the one-vs-all AdaBoost models in class order.
+    """
+    registry = registry_for(model_type, model_file, registry_dir)
+    if registry is not None:
+        return registry.load(model_file or 'best', 'tree' if model_type == 'tree' else 'stumps')
+    if model_file is not None:
+        if is_model_file(model_file):
+            return load_model_file(model_file)
+        model = load_model_with_pickle(model_file)
+        if isinstance(model, Node):
+            model = compile_tree(model)
+            return ModelFile('tree', [model], model.classes)
+        raise ValueError(f"{model_file} is neither a binary model file nor a pickled tree")
     if model_type == 'tree':
-        model = load_model_with_pickle('best_tree_sample_size_3000_acc_0.8031145717463849_max_dep_4_min_split_150.pkl')  
-        y_pred = []
-        for x in X_test:
-            y_pred.append(predict(model,x))
-        with open("tree_prediction.txt", 'w', encoding='utf-8') as outfile:
-            for prediction in y_pred:
-                outfile.write(str(prediction) + '\n')
-    elif model_type == 'stumps' or model_type == 'best':
-        model_it = load_adaboost_model("IT_adab_sample_size_1500_acc_0.9566666666666667_n_learners_10.pkl")
-        model_nl = load_adaboost_model("NL_adab_sample_size_1500_acc_0.83_n_learners_50.pkl")
-        model_en = load_adaboost_model("EN_adab_sample_size_1500_acc_0.81_n_learners_15.pkl")
-        models = [model_it,model_nl,model_en]
-        y_pred = predict_multiclass(models, X_test)
-        with open("stumps_prediction.txt", 'w', encoding='utf-8') as outfile:
-            for prediction in y_pred:
-                outfile.write(str(prediction) + '\n')
+        model = compile_tree(load_model_with_pickle('best_tree_sample_size_3000_acc_0.8031145717463849_max_dep_4_min_split_150.pkl'))  
+        return ModelFile('tree', [model], model.classes)
+    model_it = load_adaboost_model("IT_adab_sample_size_1500_acc_0.9566666666666667_n_learners_10.pkl")
+    model_nl = load_adaboost_model("NL_adab_sample_size_1500_acc_0.83_n_learners_50.pkl")
+    model_en = load_adaboost_model("EN_adab_sample_size_1500_acc_0.81_n_learners_15.pkl")
+    return ModelFile('stumps', [model_it, model_nl, model_en], ['it', 'nl', 'en'])
+
+def predict_lines(model, lines, chunk_size=4096):
+    """
+    Streams text lines through feature extraction and batch scoring.
+
+    :param model: ModelFile returned by load_prediction_model.
+    :param lines: Iterable of raw text lines.
+    :param chunk_size: Number of lines extracted and scored at a time.
+    :return: Iterator of prediction lists, one per chunk, in input order.
+    """
+    for X in iter_feature_chunks(lines, chunk_size):
+        if model.kind == 'tree':
+            yield model.models[0].predict(X)
+        else:
+            yield predict_multiclass(model.models, X, model.classes)
+
+def score_lines(model, lines):
+    """
+    Labels and scores for a batch of text lines, as returned by the prediction server.
+
+    :return: Tuple (labels, scores); a score is a {class: margin} dict for the AdaBoost
+             models and None for the tree, which has no margin.
+    """
+    if not lines:
+        return [], []
+    X = FeatureMatrix()
+    for line in lines:
+        X.append_row(line_features(line))
+    if model.kind == 'tree':
+        return model.models[0].predict(X), [None] * len(X)
+    labels, scores = [], []
+    for margins in zip(*[m.decision_function(X) for m in model.models]):
+        margins = list(margins)
+        labels.append(model.classes[margins.index(max(margins))])
+        scores.append(dict(zip(model.classes, margins)))
+    return labels, scores
+
+def serve(model_type, host='127.0.0.1', port=8000, max_batch=4096, max_wait_ms=2.0, model_file=None, registry_dir='models'):
+    # Load the models once and answer prediction requests until interrupted
+    model = load_prediction_model(model_type, model_file, registry_dir)
+    if registry_for(model_type, model_file, registry_dir) is not None:
+        # Resolve the name for every batch, so a newly registered model is served without a restart
+        server = make_server(lambda lines: score_lines(load_prediction_model(model_type, model_file, registry_dir), lines), host, port, max_batch, max_wait_ms / 1000)
+    else:
+        server = make_server(lambda lines: score_lines(model, lines), host, port, max_batch, max_wait_ms / 1000)
+    print(f"Serving {model_type} predictions on http://{host}:{server.server_port}/predict")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+def predict_all(model_type, datafile, output_file=None, chunk_size=4096, model_file=None, registry_dir='models'):
+    with phase('load_model'):
+        model = load_prediction_model(model_type, model_file, registry_dir)
+    if output_file is None:
+        output_file = "tree_prediction.txt" if model.kind == 'tree' else "stumps_prediction.txt"
+    with open(datafile, 'r', encoding='utf-8') as infile, open(output_file, 'w', encoding='utf-8') as outfile:
+        # Each chunk is written as soon as it is scored
+        with phase('predict') as timing:
+            for y_pred in predict_lines(model, infile, chunk_size):
+                outfile.write(''.join(str(prediction) + '\n' for prediction in y_pred))
+                timing.add(rows=len(y_pred))
     #elif model_type == 'best':
     #    model = BestModel()  # Load or initialize your best overall model
 
@@ -151,25 +363,91 @@ def predict_all(model_type, datafile):
     ## Print out the language prediction for each test case
     #pass
 
+def batch_predict_all(model_type, datafile, output_file=None, workers=None, chunk_bytes=1 << 22, max_in_flight=None,
+                      model_file=None, registry_dir='models', resume=True):
+    # predict_all for very large files: chunks are scored on a process pool, resumably
+    with phase('load_model'):
+        model = load_prediction_model(model_type, model_file, registry_dir)
+    if output_file is None:
+        output_file = "tree_prediction.txt" if model.kind == 'tree' else "stumps_prediction.txt"
+    n_lines = batch_predict(model, datafile, output_file, predict_lines, workers=workers, chunk_bytes=chunk_bytes,
+                            max_in_flight=max_in_flight, resume=resume)
+    print(f"Predicted {n_lines} lines into '{output_file}'")
+
 def main():
     parser = argparse.ArgumentParser(description="Wiki Language Classification")
+    parser.add_argument('--profile', default=None, metavar='FILE', help="Write phase timings as JSON lines to FILE, or to standard error when FILE is -")
     subparsers = parser.add_subparsers(dest='command')
 
     # Train subparser
     train_parser = subparsers.add_parser('train')
     train_parser.add_argument('sample_data_amount', type=int, help="Amount of sample data for training, default is 1000, you can try higher number but not recommend.")
+    train_parser.add_argument('--data', default=None, help="Feature file to train on, text lines or a binary file from featureStore.py; default is the loadData file.")
+    train_parser.add_argument('--registry', default='models', help="Model registry directory the trained models are added to")
+    train_parser.add_argument('--workers', type=int, default=None, help="Number of processes for hyperparameter search, default is the number of CPUs.")
+    train_parser.add_argument('--seed', type=int, default=0, help="Seed of the cached sample and train/validation split; with --no-cache the sample is unseeded")
+    train_parser.add_argument('--cache', default='.dataset_cache', help="Directory of cached, parsed train/validation splits")
+    train_parser.add_argument('--no-cache', action='store_true', help="Sample, parse and split the data anew without the cache")
+
+    # Out-of-core train subparser
+    stream_parser = subparsers.add_parser('train-stream', help="Train on a whole feature file in passes over chunks, without loading it")
+    stream_parser.add_argument('data', help="Labelled feature file, text lines or a binary file from featureStore.py (faster)")
+    stream_parser.add_argument('--max-depth', type=int, default=5, help="Maximum depth of the decision tree")
+    stream_parser.add_argument('--min-samples-split', type=int, default=None, help="Minimum rows to split a tree node, default 1%% of the training rows")
+    stream_parser.add_argument('--n-learners', type=int, default=50, help="Number of boosting rounds of each one-vs-all model")
+    stream_parser.add_argument('--chunk-size', type=int, default=65536, help="Rows read at a time")
+    stream_parser.add_argument('--max-bins', type=int, default=256, help="Maximum candidate thresholds per feature")
+    stream_parser.add_argument('--memory-mb', type=int, default=256, help="Memory for the tree node histograms")
+    stream_parser.add_argument('--registry', default='models', help="Model registry directory the trained models are added to")
 
     # Predict subparser
     predict_parser = subparsers.add_parser('predict')
     predict_parser.add_argument('model_type', choices=['tree', 'stumps', 'best'])
     predict_parser.add_argument('datafile', help="Data file for making predictions")
+    predict_parser.add_argument('--model', default=None, help="Registry name ('best', 'latest', alias or model ID), binary model file (.lrm) or pickled tree; default is the registry's best model")
+    predict_parser.add_argument('--registry', default='models', help="Model registry directory")
+    predict_parser.add_argument('--output', default=None, help="Prediction file, default is tree_prediction.txt or stumps_prediction.txt")
+
+    # Batch predict subparser
+    batch_parser = subparsers.add_parser('batch-predict', help="Predict a very large file on all cores, resuming after an interruption")
+    batch_parser.add_argument('model_type', choices=['tree', 'stumps', 'best'])
+    batch_parser.add_argument('datafile', help="Data file for making predictions, one segment per line")
+    batch_parser.add_argument('--model', default=None, help="Registry name ('best', 'latest', alias or model ID), binary model file (.lrm) or pickled tree; default is the registry's best model")
+    batch_parser.add_argument('--registry', default='models', help="Model registry directory")
+    batch_parser.add_argument('--output', default=None, help="Prediction file, default is tree_prediction.txt or stumps_prediction.txt")
+    batch_parser.add_argument('--workers', type=int, default=None, help="Number of worker processes, default is the number of CPUs")
+    batch_parser.add_argument('--chunk-mb', type=float, default=4, help="Input megabytes per task")
+    batch_parser.add_argument('--max-in-flight', type=int, default=None, help="Maximum chunks in progress at once, default twice the workers")
+    batch_parser.add_argument('--no-resume', action='store_true', help="Start over instead of continuing from the checkpoint")
+
+    # Serve subparser
+    serve_parser = subparsers.add_parser('serve')
+    serve_parser.add_argument('model_type', choices=['tree', 'stumps', 'best'])
+    serve_parser.add_argument('--model', default=None, help="Registry name ('best', 'latest', alias or model ID), binary model file (.lrm) or pickled tree; default is the registry's best model")
+    serve_parser.add_argument('--registry', default='models', help="Model registry directory")
+    serve_parser.add_argument('--host', default='127.0.0.1', help="Address to listen on")
+    serve_parser.add_argument('--port', type=int, default=8000, help="Port to listen on")
+    serve_parser.add_argument('--max-batch', type=int, default=4096, help="Maximum number of lines scored together")
+    serve_parser.add_argument('--max-wait-ms', type=float, default=2.0, help="How long to wait for more requests to batch")
 
     args = parser.parse_args()
 
+    if args.profile is not None:
+        instrumentation.enable(None if args.profile == '-' else args.profile)
+
     if args.command == 'train':
-        train_model(args.sample_data_amount)
+        train_model(args.sample_data_amount, workers=args.workers, data_file=args.data, registry_dir=args.registry,
+                    seed=args.seed, cache_dir=None if args.no_cache else args.cache)
+    elif args.command == 'train-stream':
+        train_out_of_core(args.data, args.max_depth, args.min_samples_split, args.n_learners, chunk_size=args.chunk_size,
+                          max_bins=args.max_bins, memory_mb=args.memory_mb, registry_dir=args.registry)
     elif args.command == 'predict':
-        predict_all(args.model_type, args.datafile)
+        predict_all(args.model_type, args.datafile, output_file=args.output, model_file=args.model, registry_dir=args.registry)
+    elif args.command == 'batch-predict':
+        batch_predict_all(args.model_type, args.datafile, output_file=args.output, workers=args.workers, chunk_bytes=int(args.chunk_mb * (1 << 20)),
+                          max_in_flight=args.max_in_flight, model_file=args.model, registry_dir=args.registry, resume=not args.no_resume)
+    elif args.command == 'serve':
+        serve(args.model_type, args.host, args.port, args.max_batch, args.max_wait_ms, model_file=args.model, registry_dir=args.registry)
     else:
         parser.print_help()
 